@@ -194,6 +194,45 @@ LOGOUT_REDIRECT_URL = '/'
 STRIPE_PUBLIC_KEY = config('STRIPE_PUBLIC_KEY', default='pk_test_your_stripe_public_key')
 STRIPE_SECRET_KEY = config('STRIPE_SECRET_KEY', default='sk_test_your_stripe_secret_key')
 
+# Redis, shared by the autocomplete index and other cross-worker state
+REDIS_URL = config('REDIS_URL', default=None)
+AUTOCOMPLETE_REDIS_URL = config('AUTOCOMPLETE_REDIS_URL', default=REDIS_URL)
+FLASH_SALE_REDIS_URL = config('FLASH_SALE_REDIS_URL', default=REDIS_URL)
+
+# Cache: shared through Redis when available, otherwise local to each process
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Celery: tasks go through Redis when available, otherwise they run inline
+CELERY_BROKER_URL = config('CELERY_BROKER_URL', default=REDIS_URL)
+CELERY_TASK_ALWAYS_EAGER = not CELERY_BROKER_URL
+CELERY_TIMEZONE = TIME_ZONE
+CELERY_BEAT_SCHEDULE = {
+    'sync-flash-sale-campaigns': {
+        'task': 'store.tasks.sync_due_flash_sale_campaigns',
+        'schedule': 60,
+    },
+    'reconcile-flash-sales': {
+        'task': 'store.tasks.reconcile_flash_sales',
+        'schedule': 60,
+    },
+    'refresh-trending': {
+        'task': 'store.tasks.refresh_trending',
+        'schedule': 15 * 60,
+    },
+}
+
 # Session settings
 SESSION_COOKIE_AGE = 86400  # 24 hours
 CART_SESSION_ID = 'cart'
@@ -0,0 +1,216 @@
+"""
+Bulk import of supplier feeds into ImportedProduct and the store's Product.
+
+ImportedProduct.save() takes 5+ queries to import a single item (probing
+slugs one by one, creating the product, then saving itself twice), which is
+far too slow for supplier catalogues of hundreds of thousands of SKUs.
+FeedImporter imports rows in batches instead: each batch is validated with
+the model fields' own validation, matched to the rows already imported for
+the same supplier and SKU, given slugs by store.slugs and written with
+bulk_create/bulk_update in one transaction, along with its products (see
+reconcile.py). Feeds are read a row at a time, so memory is bounded by the
+batch size.
+
+Feeds are CSV files with a header row or JSON Lines files, with the fields
+in FEED_FIELDS; `category` is a category slug. A row whose SKU was imported
+before from the same supplier updates that row if anything changed, and its
+product's stock moves by the change in quantity, so importing the same feed
+again changes nothing. Rows without a SKU always create a product.
+"""
+import csv
+import json
+from collections import defaultdict
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from store.autocomplete import autocomplete
+from store.models import Category, Product
+from store.page_cache import invalidate_page_tags
+from store.recommendations import product_sampler
+from store.slugs import allocate_slugs, retry_on_conflict
+
+from .models import ImportedProduct
+from .reconcile import create_products, reconcile
+
+FEED_FIELDS = ('sku', 'name', 'description', 'cost_price', 'selling_price', 'quantity_imported', 'category', 'supplier')
+FEED_FORMATS = ('csv', 'jsonl')
+BATCH_SIZE = 1000
+
+# Feed fields validated by the ImportedProduct field of the same name
+MODEL_FIELDS = {
+    name: ImportedProduct._meta.get_field(name)
+    for name in ('sku', 'name', 'description', 'cost_price', 'selling_price', 'quantity_imported', 'supplier')
+}
+# Feed fields copied to the store product, which must fit the Product field they are copied to as well
+PRODUCT_FIELDS = {
+    name: Product._meta.get_field(product_field)
+    for name, product_field in (
+        ('name', 'name'), ('description', 'description'), ('cost_price', 'price'), ('selling_price', 'price'),
+    )
+}
+
+
+def get_feed_format(path):
+    return 'jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv'
+
+
+def read_feed(path, feed_format=None):
+    """
+    Yield (line number, row) for each row of a feed file. Rows are dicts, or
+    the ValidationError of a JSON line that could not be parsed.
+    """
+    with open(path, newline='', encoding='utf-8-sig') as feed:
+        if (feed_format or get_feed_format(path)) == 'csv':
+            reader = csv.DictReader(feed)
+            for row in reader:
+                yield reader.line_num, row
+            return
+        for line_number, line in enumerate(feed, 1):
+            if not line.strip():
+                continue
+            try:
+                yield line_number, json.loads(line)
+            except ValueError as e:
+                yield line_number, ValidationError(f'Invalid JSON: {e}')
+
+
+def format_error(error):
+    if hasattr(error, 'error_dict'):
+        return '; '.join(f'{field}: {" ".join(messages)}' for field, messages in error.message_dict.items())
+    return ' '.join(error.messages)
+
+
+def clean_row(row, category_ids, default_supplier=''):
+    """Validate a feed row, returning the ImportedProduct field values it sets"""
+    if isinstance(row, ValidationError):
+        raise row
+    if not isinstance(row, dict):
+        raise ValidationError('Not an object')
+    values, errors = {}, {}
+    for name, field in MODEL_FIELDS.items():
+        value = row.get(name)
+        if isinstance(value, str):
+            value = value.strip()
+        if name == 'supplier':
+            value = value or default_supplier
+        if value in (None, ''):
+            value = field.get_default()
+        try:
+            values[name] = field.clean(value, None)
+            if name in PRODUCT_FIELDS:
+                PRODUCT_FIELDS[name].run_validators(values[name])
+        except ValidationError as e:
+            errors[name] = e.messages
+    if values.get('quantity_imported', 0) < 0:
+        errors['quantity_imported'] = ['Must not be negative.']
+    category = (row.get('category') or '').strip()
+    values['category_id'] = category_ids.get(category) if category else None
+    if category and values['category_id'] is None:
+        errors['category'] = [f'Unknown category {category!r}.']
+    if errors:
+        raise ValidationError(errors)
+    return values
+
+
+class FeedImporter:
+    """Imports batches of feed rows, counting the rows created, updated, unchanged and failed"""
+
+    def __init__(self, supplier=''):
+        self.supplier = supplier
+        self.category_ids = dict(Category.objects.values_list('slug', 'pk'))
+        # (supplier, SKU): line of every row imported so far, to reject repeats within the feed
+        self.seen = {}
+        self.created = self.updated = self.unchanged = self.failed = 0
+        self.products_changed = 0
+
+    def import_batch(self, rows):
+        """Import (line number, row) pairs in one transaction, returning (line number, error) for rejected rows"""
+        cleaned, errors = [], []
+        for line_number, row in rows:
+            try:
+                values = clean_row(row, self.category_ids, self.supplier)
+            except ValidationError as e:
+                errors.append((line_number, format_error(e)))
+                continue
+            if values['sku']:
+                key = (values['supplier'], values['sku'])
+                if key in self.seen:
+                    errors.append((line_number, f'SKU {values["sku"]} already imported from line {self.seen[key]}'))
+                    continue
+                self.seen[key] = line_number
+            cleaned.append(values)
+        self.failed += len(errors)
+        if cleaned:
+            # Run again if a concurrent import took one of the slugs or SKUs
+            retry_on_conflict(lambda: self.write(cleaned))
+        return errors
+
+    def get_existing(self, rows):
+        """The rows imported before with the SKUs of `rows`, by (supplier, SKU)"""
+        skus = defaultdict(list)
+        for values in rows:
+            if values['sku']:
+                skus[values['supplier']].append(values['sku'])
+        if not skus:
+            return {}
+        query = Q()
+        for supplier, supplier_skus in skus.items():
+            query |= Q(supplier=supplier, sku__in=supplier_skus)
+        return {
+            (imported.supplier, imported.sku): imported
+            # Locked until the batch is written, see reconcile()
+            for imported in ImportedProduct.objects.filter(query).select_related('store_product').select_for_update(
+                of=('self',)
+            )
+        }
+
+    def write(self, rows):
+        now = timezone.now()
+        existing = self.get_existing(rows)
+        new_imported, changed_imported, existing_imported = [], [], []
+        for values in rows:
+            imported = existing.get((values['supplier'], values['sku'])) if values['sku'] else None
+            if imported is None:
+                imported = ImportedProduct(**values)
+                new_imported.append(imported)
+            else:
+                # Rows without a category keep theirs
+                values = {**values, 'category_id': values['category_id'] or imported.category_id}
+                if any(getattr(imported, field) != value for field, value in values.items()):
+                    for field, value in values.items():
+                        setattr(imported, field, value)
+                    imported.updated_at = now
+                    changed_imported.append(imported)
+                existing_imported.append(imported)
+
+        new_products = []
+        if new_imported:
+            # New rows are inserted linked to their products, already in sync
+            for imported, slug in zip(new_imported, allocate_slugs([imported.name for imported in new_imported])):
+                imported.slug = slug
+            new_products, row_updates = create_products(new_imported)
+            Product.objects.bulk_create(new_products)
+            for imported, updates in zip(new_imported, row_updates):
+                for field, value in updates.items():
+                    setattr(imported, field, value)
+            tags = {'catalogue', *(f'category:{product.category_id}' for product in new_products)}
+            transaction.on_commit(lambda: invalidate_page_tags(*tags))
+        ImportedProduct.objects.bulk_create(new_imported)
+        # Unchanged rows too, in case their product was deleted or never synced
+        created_products, updated_products = reconcile(existing_imported, changed_imported, [
+            'name', 'description', 'cost_price', 'selling_price', 'quantity_imported', 'category', 'updated_at',
+        ])
+
+        self.created += len(new_imported)
+        self.updated += len(changed_imported)
+        self.unchanged += len(existing_imported) - len(changed_imported)
+        self.products_changed += len(new_products) + len(created_products) + len(updated_products)
+
+    def finish(self):
+        """Refresh what indexes products once the feed is imported, bulk writes send no signals"""
+        if self.products_changed:
+            autocomplete.rebuild()
+            product_sampler.invalidate()
@@ -0,0 +1,41 @@
+import time
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+
+from imported_products.importer import BATCH_SIZE, FEED_FORMATS, FeedImporter, read_feed
+
+
+class Command(BaseCommand):
+    help = 'Import a CSV or JSON Lines supplier feed into imported products and their store products, in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Feed file, JSON Lines if it ends in .jsonl or .ndjson, CSV otherwise')
+        parser.add_argument('--format', choices=FEED_FORMATS, help='Read the feed in this format whatever its name')
+        parser.add_argument('--supplier', default='', help='Supplier of the rows that name none')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Rows validated and written at a time')
+
+    def handle(self, *args, **options):
+        try:
+            rows = read_feed(options['path'], options['format'])
+            batch = list(islice(rows, options['batch_size']))
+        except OSError as e:
+            raise CommandError(f'Could not read {options["path"]}: {e}')
+
+        importer = FeedImporter(options['supplier'])
+        started = time.monotonic()
+        total = 0
+        while batch:
+            for line_number, error in importer.import_batch(batch):
+                self.stderr.write(f'Line {line_number}: {error}')
+            total += len(batch)
+            self.stdout.write(f'{total} rows, {total / (time.monotonic() - started):.0f} rows/s')
+            batch = list(islice(rows, options['batch_size']))
+        importer.finish()
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {total} rows in {elapsed:.1f}s ({total / max(elapsed, 0.001):.0f} rows/s): '
+            f'{importer.created} created, {importer.updated} updated, {importer.unchanged} unchanged, '
+            f'{importer.failed} failed'
+        ))
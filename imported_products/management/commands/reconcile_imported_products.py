@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from imported_products.models import ImportedProduct
+from imported_products.reconcile import BATCH_SIZE, reconcile_all
+from store.autocomplete import autocomplete
+from store.recommendations import product_sampler
+
+
+class Command(BaseCommand):
+    help = 'Bring store products in line with their imported products, writing only what changed since the last run'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--supplier', help='Only reconcile the products imported from this supplier')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Imported products reconciled at a time')
+
+    def handle(self, *args, **options):
+        queryset = ImportedProduct.objects.all()
+        if options['supplier'] is not None:
+            queryset = queryset.filter(supplier=options['supplier'])
+
+        created = updated = 0
+        for created_ids, updated_ids in reconcile_all(queryset, options['batch_size']):
+            created += len(created_ids)
+            updated += len(updated_ids)
+        if created or updated:
+            # Bulk writes send no signals
+            autocomplete.rebuild()
+            product_sampler.invalidate()
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Reconciled imported products: {created} products created, {updated} updated')
+        )
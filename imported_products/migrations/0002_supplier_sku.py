@@ -0,0 +1,22 @@
+# Generated by Django 4.2.30 on 2026-10-16 23:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('imported_products', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importedproduct',
+            name='sku',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AddConstraint(
+            model_name='importedproduct',
+            constraint=models.UniqueConstraint(condition=models.Q(('sku', ''), _negated=True), fields=('supplier', 'sku'), name='imported_product_supplier_sku_unique'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.30 on 2026-10-16 23:11
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def mark_quantities_synced(apps, schema_editor):
+    # ImportedProduct.save() already added these quantities to the linked products' stock
+    ImportedProduct = apps.get_model('imported_products', 'ImportedProduct')
+    ImportedProduct.objects.filter(store_product__isnull=False).update(quantity_synced=F('quantity_imported'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('imported_products', '0002_supplier_sku'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importedproduct',
+            name='content_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='importedproduct',
+            name='quantity_synced',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(mark_quantities_synced, migrations.RunPython.noop),
+    ]
@@ -1,5 +1,7 @@
-from django.db import models
+from django.db import models, transaction
+from store.autocomplete import autocomplete
 from store.models import Product, Category # Assuming Category is also needed for product creation
+from store.slugs import retry_on_conflict, save_with_unique_slug
 
 class ImportedProduct(models.Model):
     name = models.CharField(max_length=255)
@@ -9,8 +11,14 @@ class ImportedProduct(models.Model):
     # Adding selling_price to ImportedProduct as well for initial pricing
     selling_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
     supplier = models.CharField(max_length=255, blank=True)
+    # The supplier's own product code, matching re-imported feed rows to this one (see importer.py)
+    sku = models.CharField(max_length=100, blank=True)
     import_date = models.DateField(auto_now_add=True)
     quantity_imported = models.IntegerField(default=1)
+    # What was last applied to store_product, see reconcile.py: a hash of the product fields
+    # this row sets, and the quantity already added to its stock
+    content_hash = models.CharField(max_length=64, blank=True, editable=False)
+    quantity_synced = models.IntegerField(default=0, editable=False)
     # Link to the actual Product in the store app
     store_product = models.ForeignKey(
         Product, 
@@ -28,55 +36,41 @@ class ImportedProduct(models.Model):
         ordering = ['name']
         verbose_name = 'Imported Product'
         verbose_name_plural = 'Imported Products'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['supplier', 'sku'], condition=~models.Q(sku=''), name='imported_product_supplier_sku_unique'
+            ),
+        ]
 
     def __str__(self):
         return self.name
 
     def save(self, *args, **kwargs):
-        from django.utils.text import slugify
-
         if not self.slug:
-            self.slug = slugify(self.name)
-            # Ensure slug is unique, append a number if necessary
-            original_slug = self.slug
-            num = 1
-            while ImportedProduct.objects.filter(slug=self.slug).exists():
-                self.slug = f"{original_slug}-{num}"
-                num += 1
+            # Allocated free as a Product slug too, for the product created below
+            save_with_unique_slug(self, self.name, lambda: self.save(*args, **kwargs))
+            return
 
-        super().save(*args, **kwargs)
+        from .reconcile import reconcile
 
-        # Create or update the corresponding Product in the store app
-        if self.store_product:
-            # Update existing product
-            product = self.store_product
-            product.name = self.name
-            product.slug = self.slug
-            product.description = self.description
-            product.price = self.selling_price if self.selling_price is not None else self.cost_price # Use selling price if available
-            product.stock += self.quantity_imported # Add imported quantity to existing stock
-            if self.category: # Update category if provided
-                product.category = self.category
-            product.save()
-        else:
-            # Create a new product
-            # Ensure a category is present for the new product
-            if self.category is None:
-                # Fallback to a default category if none is provided
-                # Or create a default one if it doesn't exist
-                default_category, created = Category.objects.get_or_create(
-                    name='Uncategorized', slug='uncategorized'
-                )
-                self.category = default_category
+        def sync():
+            save_kwargs = kwargs
+            if not self._state.adding:
+                # What was last applied to the product is written by reconcile() alone: an instance loaded
+                # before a concurrent sync or import holds old values, read them afresh under lock
+                state = ImportedProduct.objects.select_for_update().filter(pk=self.pk).values_list(
+                    'content_hash', 'quantity_synced'
+                ).first()
+                if state is not None:
+                    self.content_hash, self.quantity_synced = state
+                    if not args and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+                        save_kwargs = {**kwargs, 'update_fields': [
+                            field.name for field in self._meta.concrete_fields
+                            if not field.primary_key and field.name not in ('content_hash', 'quantity_synced')
+                        ]}
+            super(ImportedProduct, self).save(*args, **save_kwargs)
+            # Create or update the corresponding Product in the store app
+            return reconcile([self])
 
-            product = Product.objects.create(
-                name=self.name,
-                slug=self.slug,
-                description=self.description,
-                price=self.selling_price if self.selling_price is not None else self.cost_price,
-                category=self.category,
-                stock=self.quantity_imported,
-                available=True, # Imported products are available by default
-            )
-            self.store_product = product
-            self.save() # Save ImportedProduct again to link to the new store_product
+        created, updated = retry_on_conflict(sync)
+        transaction.on_commit(lambda: autocomplete.products_updated(created + updated))
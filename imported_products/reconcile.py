@@ -0,0 +1,184 @@
+"""
+Reconciliation of imported products with their store products.
+
+ImportedProduct.save() used to copy its fields to its product on every
+save, raising the stock by quantity_imported with a read-modify-write:
+concurrent saves lost stock updates, and saving or importing a row again
+counted its quantity twice. reconcile() now brings the products of a batch
+of imported rows in line with them, and writes only what changed:
+
+- rows without a product get one, created in bulk
+- rows whose product fields changed since they were last applied, which
+  content_hash tells without comparing the product, write the fields that
+  differ from the product with bulk_update
+- rows whose quantity_imported differs from quantity_synced, the quantity
+  already in the stock, change the stock by the difference, with F()
+  expressions in a single UPDATE
+
+so rows unchanged since the last run are not written at all. The
+reconcile_imported_products command runs it over the whole table, and
+import_products and ImportedProduct.save() over the rows they write.
+"""
+import hashlib
+import json
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from store.models import PLACEHOLDER_IMAGE, Category, Product
+from store.page_cache import invalidate_page_tags
+from store.slugs import allocate_slugs, retry_on_conflict
+
+from .models import ImportedProduct
+
+BATCH_SIZE = 1000
+# What reconcile() reads of imported rows and their products
+IMPORTED_FIELDS = (
+    'name', 'slug', 'description', 'cost_price', 'selling_price', 'quantity_imported', 'category',
+    'content_hash', 'quantity_synced', 'store_product',
+    'store_product__name', 'store_product__description', 'store_product__price', 'store_product__category',
+)
+
+
+def get_product_values(imported):
+    return {
+        'name': imported.name,
+        'description': imported.description,
+        'price': imported.selling_price if imported.selling_price is not None else imported.cost_price,
+        # Rows without a category leave the product's as it is
+        'category_id': imported.category_id,
+    }
+
+
+def get_field_names(attnames):
+    """Field names for bulk_update() of attributes set by their attname"""
+    return ['category' if attname == 'category_id' else attname for attname in attnames]
+
+
+def get_content_hash(values):
+    content = [values['name'], values['description'], f'{values["price"]:.2f}', values['category_id']]
+    return hashlib.sha256(json.dumps(content).encode()).hexdigest()
+
+
+def get_default_category_id():
+    # Products need a category
+    category, _ = Category.objects.get_or_create(slug='uncategorized', defaults={'name': 'Uncategorized'})
+    return category.pk
+
+
+def create_products(unlinked):
+    """Unsaved products for imported rows without one, with the rows' field updates"""
+    # A product takes its row's slug when no product has it already
+    taken = set(Product.objects.filter(slug__in=[imported.slug for imported in unlinked]).values_list('slug', flat=True))
+    fresh_slugs = iter(allocate_slugs([imported.name for imported in unlinked if imported.slug in taken]))
+    default_category_id = None
+    products, row_updates = [], []
+    for imported in unlinked:
+        values = get_product_values(imported)
+        if values['category_id'] is None:
+            default_category_id = default_category_id or get_default_category_id()
+            values['category_id'] = default_category_id
+        product = Product(
+            **values,
+            slug=next(fresh_slugs) if imported.slug in taken else imported.slug,
+            stock=max(imported.quantity_imported, 0),
+            available=True,
+            primary_image_src=PLACEHOLDER_IMAGE,
+        )
+        products.append(product)
+        row_updates.append({
+            'store_product': product,
+            'category_id': values['category_id'],
+            'content_hash': get_content_hash(values),
+            'quantity_synced': imported.quantity_imported,
+        })
+    return products, row_updates
+
+
+def reconcile(imported_products, changed=(), changed_fields=()):
+    """
+    Bring the products of `imported_products` in line with them, returning
+    the ids of the products created and of those updated. The rows are only
+    changed once everything is written, so a failed call can be run again.
+    Runs in the transaction that loaded the rows with select_for_update(),
+    so their content_hash and quantity_synced are current.
+    Rows in `changed` were modified by the caller, and are saved with their
+    `changed_fields` in the same bulk_update() as the reconciled rows.
+    """
+    now = timezone.now()
+    unlinked = []
+    updated = {}                                   # ImportedProduct: its field updates
+    product_updates = defaultdict(list)            # fields changed: products with their new values
+    stock_deltas = defaultdict(int)
+    tags = set()
+    for imported in imported_products:
+        if imported.store_product_id is None:
+            unlinked.append(imported)
+            continue
+        product = imported.store_product
+        row_updates = {}
+        values = get_product_values(imported)
+        content_hash = get_content_hash(values)
+        if content_hash != imported.content_hash:
+            differing = {
+                field: value for field, value in values.items()
+                if value is not None and getattr(product, field) != value
+            }
+            if differing:
+                product_updates[tuple(differing)].append(Product(pk=product.pk, updated_at=now, **differing))
+                tags.add(f'category:{values["category_id"] or product.category_id}')
+            row_updates['content_hash'] = content_hash
+        if imported.quantity_imported != imported.quantity_synced:
+            stock_deltas[product.pk] += imported.quantity_imported - imported.quantity_synced
+            row_updates['quantity_synced'] = imported.quantity_imported
+        if row_updates:
+            updated[imported] = row_updates
+            tags.update([f'product:{product.pk}', f'category:{product.category_id}'])
+
+    created = []
+    if unlinked:
+        created, row_updates = create_products(unlinked)
+        Product.objects.bulk_create(created)
+        updated.update(zip(unlinked, row_updates))
+        tags.update(f'category:{product.category_id}' for product in created)
+    for fields, products in product_updates.items():
+        Product.objects.bulk_update(products, get_field_names([*fields, 'updated_at']))
+    if stock_deltas:
+        delta = Case(
+            *[When(pk=product_id, then=Value(delta)) for product_id, delta in stock_deltas.items()],
+            default=Value(0), output_field=IntegerField(),
+        )
+        # A supplier lowering a quantity below what was sold since leaves no stock rather than a negative one
+        Product.objects.filter(pk__in=stock_deltas).update(stock=Greatest(F('stock') + delta, Value(0)), updated_at=now)
+
+    saved = {**dict.fromkeys(changed, {}), **updated}
+    if saved:
+        fields = set(changed_fields) if changed else set()
+        for imported, row_updates in saved.items():
+            for field, value in row_updates.items():
+                setattr(imported, field, value)
+            fields.update(row_updates)
+        ImportedProduct.objects.bulk_update(list(saved), get_field_names(fields))
+
+    created_ids = [product.pk for product in created]
+    updated_ids = list({product.pk for products in product_updates.values() for product in products} | set(stock_deltas))
+    if tags:
+        tags.add('catalogue')
+        transaction.on_commit(lambda: invalidate_page_tags(*tags))
+    return created_ids, updated_ids
+
+
+def reconcile_all(queryset=None, batch_size=BATCH_SIZE):
+    """Yield the result of reconcile() for each batch of imported rows in `queryset`, all by default"""
+    queryset = queryset if queryset is not None else ImportedProduct.objects.all()
+    pks = list(queryset.order_by('pk').values_list('pk', flat=True))
+    for start in range(0, len(pks), batch_size):
+        batch = ImportedProduct.objects.filter(pk__in=pks[start:start + batch_size])
+        # Loaded for each attempt, so rows are read again after a conflict, and locked so that a
+        # concurrent save or import of a row waits rather than applying the same quantity change
+        yield retry_on_conflict(lambda: reconcile(
+            batch.select_related('store_product').select_for_update(of=('self',)).only(*IMPORTED_FIELDS)
+        ))
@@ -1,3 +1,81 @@
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
 from django.test import TestCase
 
-# Create your tests here.
+from store.models import Product
+
+from .importer import FeedImporter, clean_row
+from .models import ImportedProduct
+from .reconcile import reconcile_all
+
+
+class FeedImporterTests(TestCase):
+    def row(self, **values):
+        return {'sku': 'SKU1', 'name': 'Shirt', 'cost_price': '10.00', 'quantity_imported': '3', **values}
+
+    def test_import_creates_products(self):
+        errors = FeedImporter('acme').import_batch([(2, self.row())])
+        self.assertEqual(errors, [])
+        imported = ImportedProduct.objects.get(supplier='acme', sku='SKU1')
+        self.assertEqual(imported.store_product.stock, 3)
+
+    def test_name_too_long_for_product(self):
+        # Fits ImportedProduct.name but not Product.name
+        name = 'x' * 201
+        with self.assertRaisesMessage(ValidationError, 'at most 200 characters'):
+            clean_row(self.row(name=name), {})
+        errors = FeedImporter('acme').import_batch([(2, self.row(name=name)), (3, self.row(sku='SKU2'))])
+        self.assertEqual([line_number for line_number, error in errors], [2])
+        self.assertIn('name:', errors[0][1])
+        self.assertEqual(list(Product.objects.values_list('name', flat=True)), ['Shirt'])
+
+
+class ReconcileTests(TestCase):
+    def setUp(self):
+        ImportedProduct.objects.bulk_create([
+            ImportedProduct(name='Shirt', slug='shirt', cost_price=Decimal('10.00'), quantity_imported=3),
+            ImportedProduct(name='Hat', slug='hat', cost_price=Decimal('5.00'), quantity_imported=2),
+        ])
+        self.reconcile()
+        self.shirt = ImportedProduct.objects.get(slug='shirt')
+
+    def reconcile(self):
+        created, updated = [], []
+        for batch_created, batch_updated in reconcile_all():
+            created += batch_created
+            updated += batch_updated
+        return created, updated
+
+    def get_product(self):
+        return Product.objects.get(pk=self.shirt.store_product_id)
+
+    def test_creates_products(self):
+        product = self.get_product()
+        self.assertEqual((product.slug, product.price, product.stock), ('shirt', Decimal('10.00'), 3))
+        self.assertEqual(Product.objects.count(), 2)
+
+    def test_unchanged_rows_write_nothing(self):
+        # The ids, then the batch in a savepoint
+        with self.assertNumQueries(4):
+            self.assertEqual(self.reconcile(), ([], []))
+
+    def test_applies_changes_once(self):
+        ImportedProduct.objects.filter(pk=self.shirt.pk).update(quantity_imported=5, selling_price=Decimal('15.00'))
+        Product.objects.filter(pk=self.shirt.store_product_id).update(stock=1)  # 2 sold meanwhile
+        self.assertEqual(self.reconcile(), ([], [self.shirt.store_product_id]))
+        self.reconcile()
+        product = self.get_product()
+        self.assertEqual((product.price, product.stock), (Decimal('15.00'), 3))
+
+    def test_stale_instance_save_does_not_reapply_quantity(self):
+        # Loaded before a sync applied a new quantity
+        ImportedProduct.objects.filter(pk=self.shirt.pk).update(quantity_imported=5)
+        self.reconcile()
+        self.shirt.quantity_imported = 5
+        self.shirt.name = 'Shirt 2'
+        self.shirt.save()
+        product = self.get_product()
+        self.assertEqual((product.name, product.stock), ('Shirt 2', 5))
+        self.shirt.refresh_from_db()
+        self.assertEqual(self.shirt.quantity_synced, 5)
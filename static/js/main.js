@@ -423,6 +423,139 @@ function showNotification(message, type = 'info') {
     }, 5000);
 }
 
+// Product grids
+// Renders the JSON returned by the product and category grid XHR requests
+// (store/cards.py) with the same markup as templates/store/_product_grid.html
+const PLACEHOLDER_IMAGE = 'data:image/svg+xml;base64,PHN2ZyB3aWR0aD0iMjAwIiBoZWlnaHQ9IjIwMCIgeG1sbnM9Imh0dHA6Ly93d3cudzMub3JnLzIwMDAvc3ZnIj48cmVjdCB3aWR0aD0iMTAwJSIgaGVpZ2h0PSIxMDAlIiBmaWxsPSIjZjhmOWZhIi8+PHRleHQgeD0iNTAlIiB5PSI1MCUiIGZvbnQtZmFtaWx5PSJBcmlhbCwgc2Fucy1zZXJpZiIgZm9udC1zaXplPSIxNCIgZmlsbD0iIzk5OTk5OSIgdGV4dC1hbmNob3I9Im1pZGRsZSIgZHk9Ii4zZW0iPk5vIEltYWdlPC90ZXh0Pjwvc3ZnPg==';
+
+function escapeHtml(value) {
+    return String(value)
+        .replace(/&/g, '&amp;')
+        .replace(/</g, '&lt;')
+        .replace(/>/g, '&gt;')
+        .replace(/"/g, '&quot;')
+        .replace(/'/g, '&#x27;');
+}
+
+function fillUrl(template, product) {
+    return template.replace('{id}', product.id).replace('{slug}', encodeURIComponent(product.slug));
+}
+
+function renderProductCard(product, data, csrfInput) {
+    let prices = `<span class="fw-bold">৳${product.price}</span>`;
+    if (product.sale_price !== null) {
+        prices = `
+            <span class="text-decoration-line-through text-muted">৳${product.price}</span>
+            <span class="text-danger fw-bold">৳${product.sale_price}</span>
+            ${product.discount ? `<span class="ms-2 badge bg-danger">-${product.discount}%</span>` : ''}`;
+    }
+
+    let rating = '';
+    if (product.rating) {
+        let stars = '';
+        for (let i = 1; i <= 5; i++) {
+            stars += `<i class="${i <= product.rating ? 'fas' : 'far'} fa-star"></i>`;
+        }
+        rating = `<div class="text-warning mb-2">${stars} <small class="text-muted">(${product.reviews})</small></div>`;
+    }
+
+    let wishlist = '';
+    if (data.authenticated) {
+        wishlist = `
+            <form method="POST" action="${fillUrl(data.urls.add_to_wishlist, product)}" class="d-inline ms-2 ajax-wishlist-form">
+                ${csrfInput}
+                <button type="submit" class="btn btn-outline-danger btn-sm">
+                    <i class="${product.in_wishlist ? 'fas' : 'far'} fa-heart"></i>
+                </button>
+            </form>`;
+    }
+
+    const name = escapeHtml(product.name);
+    return `
+    <div class="col-md-4 mb-4">
+        <div class="card h-100 shadow-sm">
+            <a href="${fillUrl(data.urls.detail, product)}">
+                <div class="card-img-top" style="height: 200px; overflow: hidden; background: #f8f9fa;">
+                    <img src="${escapeHtml(product.image)}" class="w-100 h-100" alt="${name}" style="object-fit: cover;" onerror="this.src='${PLACEHOLDER_IMAGE}';">
+                </div>
+            </a>
+            <div class="card-body d-flex flex-column">
+                <h6 class="card-title d-flex align-items-center justify-content-between">
+                    ${name}
+                    ${product.flash_sale ? '<span class="badge bg-warning text-dark ms-2">⚡ Flash Sale</span>' : ''}
+                </h6>
+                <p class="card-text text-muted">${escapeHtml(product.summary)}</p>
+                <div class="mt-auto">
+                    <div class="d-flex justify-content-between align-items-center mb-2">${prices}</div>
+                    ${rating}
+                    <div class="d-grid d-md-flex gap-2 mt-2">
+                        <form method="POST" action="${fillUrl(data.urls.add_to_cart, product)}" class="d-inline w-100 ajax-add-to-cart-form">
+                            ${csrfInput}
+                            <input type="hidden" name="quantity" value="1">
+                            <button type="submit" class="btn btn-primary btn-sm w-100">
+                                <i class="fas fa-shopping-cart me-1"></i> Add to Cart
+                            </button>
+                        </form>
+                        <form method="POST" action="${fillUrl(data.urls.buy_now, product)}" class="d-inline w-100 ms-md-2">
+                            ${csrfInput}
+                            <input type="hidden" name="quantity" value="1">
+                            <button type="submit" class="btn btn-success btn-sm w-100">
+                                <i class="fas fa-money-bill-wave me-1"></i> Buy Now
+                            </button>
+                        </form>
+                        ${wishlist}
+                    </div>
+                </div>
+            </div>
+        </div>
+    </div>`;
+}
+
+function renderPagination(page, url) {
+    if (page.previous === null && page.next === null) {
+        return '';
+    }
+    // Keep the current filters in the page links
+    const params = new URLSearchParams(url.split('?')[1] || '');
+    params.delete('page');
+    const query = params.toString();
+    const link = (value, label) => `
+        <li class="page-item">
+            <a class="page-link" href="?page=${encodeURIComponent(value)}${query ? '&' + query : ''}">${label}</a>
+        </li>`;
+
+    let items = page.previous !== null ? link(page.previous, 'Previous') : '';
+    if (page.number !== null) {
+        for (let num = Math.max(1, page.number - 2); num <= Math.min(page.num_pages, page.number + 2); num++) {
+            items += num === page.number
+                ? `<li class="page-item active"><span class="page-link">${num}</span></li>`
+                : link(num, num);
+        }
+    }
+    if (page.next !== null) {
+        items += link(page.next, 'Next');
+    }
+    return `
+    <nav aria-label="Product pagination">
+        <ul class="pagination justify-content-center mt-4">${items}</ul>
+    </nav>`;
+}
+
+function renderProductGrid(container, data, url) {
+    const csrfInput = `<input type="hidden" name="csrfmiddlewaretoken" value="${escapeHtml(getCookie('csrftoken') || '')}">`;
+    let cards = data.products.map(product => renderProductCard(product, data, csrfInput)).join('');
+    if (!data.products.length) {
+        cards = `
+        <div class="text-center py-5">
+            <i class="fas fa-search fa-3x text-muted mb-3"></i>
+            <h4>No products found</h4>
+            <p class="text-muted">Try adjusting your search criteria or browse our categories.</p>
+            <a href="${data.urls.product_list}" class="btn btn-primary">View All Products</a>
+        </div>`;
+    }
+    container.innerHTML = `<div class="row" id="product-grid-container">${cards}</div>${renderPagination(data.page, url)}`;
+}
+
 // Debounce function
 function debounce(func, wait) {
     let timeout;
@@ -455,5 +588,6 @@ window.Omniferous = {
     showNotification,
     formatCurrency,
     debounce,
-    throttle
+    throttle,
+    renderProductGrid
 };
@@ -1,10 +1,11 @@
 from django.contrib import admin
-from .models import Category, Product, ProductImage, Review, Cart, CartItem, Order, OrderItem, Wishlist, Ad, FlashSaleCampaign, FlashSaleItem, DeliveryMan
+from .models import Category, Product, ProductImage, Review, Cart, CartItem, Order, OrderItem, Wishlist, Ad, FlashSaleCampaign, FlashSaleItem, FlashSalePriceAudit, DeliveryMan, MirroredImage
 from django.utils.html import mark_safe
 from django.db import transaction
 from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth.models import User, Group
 from django import forms
+from .slugs import save_with_unique_slug
 
 class DeliveryUserChangeForm(forms.ModelForm):
     is_delivery_person = forms.BooleanField(label='Is Delivery Person', required=False)
@@ -91,31 +92,23 @@ class ProductAdmin(admin.ModelAdmin):
     list_filter = ['available', 'featured', 'category', 'created_at']
     list_editable = ['price', 'sale_price', 'stock', 'available', 'featured']
     search_fields = ['name', 'description']
-    prepopulated_fields = {'slug': ('name',)}
     inlines = [ProductImageInline]
     fields = (
         'category', 'name', 'slug', 'description', 'price', 'sale_price',
         'stock', 'available', 'featured', 'image', 'image_url'
     )
 
-    def save_model(self, request, obj, form, change):
-        """
-        When a product's sale_price is updated, update all FlashSaleItem(s) for this product
-        to use the latest sale_price, unless their sale_price was manually set to something else.
-        """
-        old_obj = None
-        if obj.pk:
-            try:
-                old_obj = Product.objects.get(pk=obj.pk)
-            except Product.DoesNotExist:
-                old_obj = None
-
-        super().save_model(request, obj, form, change)
+    def get_form(self, request, obj=None, **kwargs):
+        form = super().get_form(request, obj, **kwargs)
+        form.base_fields['slug'].required = False
+        form.base_fields['slug'].help_text = 'Leave blank to number a free slug from the name, like "t-shirt-3".'
+        return form
 
-        # If the sale_price has changed, update all related FlashSaleItem(s)
-        if old_obj and old_obj.sale_price != obj.sale_price:
-            # Update all FlashSaleItem(s) for this product to use the new sale_price
-            FlashSaleItem.objects.filter(product=obj).update(sale_price=obj.sale_price)
+    def save_model(self, request, obj, form, change):
+        if obj.slug:
+            super().save_model(request, obj, form, change)
+        else:
+            save_with_unique_slug(obj, obj.name, lambda: super(ProductAdmin, self).save_model(request, obj, form, change))
 
 
 @admin.register(Review)
@@ -204,9 +197,26 @@ class FlashSaleItemInline(admin.TabularInline):
 
 @admin.register(FlashSaleCampaign)
 class FlashSaleCampaignAdmin(admin.ModelAdmin):
-    list_display = ['name', 'start_date', 'end_date', 'is_active', 'is_currently_active']
+    list_display = ['name', 'start_date', 'end_date', 'is_active', 'is_currently_active', 'prices_applied_at', 'prices_reverted_at']
     list_filter = ['is_active', 'start_date', 'end_date']
     search_fields = ['name']
     list_editable = ['is_active']
     inlines = [FlashSaleItemInline]
-    fields = ('name', 'start_date', 'end_date', 'is_active')
+    fields = ('name', 'start_date', 'end_date', 'is_active', 'prices_applied_at', 'prices_reverted_at')
+    readonly_fields = ('prices_applied_at', 'prices_reverted_at')
+
+
+@admin.register(FlashSalePriceAudit)
+class FlashSalePriceAuditAdmin(admin.ModelAdmin):
+    list_display = ['product', 'campaign', 'previous_sale_price', 'applied_sale_price', 'applied_at', 'reverted_at']
+    list_filter = ['campaign', 'applied_at', 'reverted_at']
+    search_fields = ['product__name', 'campaign__name']
+    list_select_related = ['product', 'campaign']
+    readonly_fields = ['campaign', 'product', 'previous_sale_price', 'applied_sale_price', 'applied_at', 'reverted_at']
+
+
+@admin.register(MirroredImage)
+class MirroredImageAdmin(admin.ModelAdmin):
+    list_display = ['url', 'is_mirrored', 'attempts', 'mirrored_at', 'updated_at']
+    search_fields = ['url', 'content_hash']
+    readonly_fields = ['url', 'url_hash', 'content_hash', 'variants', 'attempts', 'error', 'mirrored_at', 'created_at', 'updated_at']
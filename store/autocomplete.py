@@ -0,0 +1,335 @@
+"""
+In-process autocomplete for the navbar search.
+
+Product names live in an array-backed trigram index so suggestions are
+answered from memory without touching the database. Each gunicorn worker
+keeps its own copy. Product signals update it incrementally, and when
+AUTOCOMPLETE_REDIS_URL (or REDIS_URL) is set, every change is also published
+to Redis so all workers converge on the same index.
+"""
+import json
+import logging
+import threading
+import time
+from array import array
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from redis.exceptions import RedisError
+
+logger = logging.getLogger(__name__)
+
+# Keys of the shared snapshot in Redis
+ENTRIES_KEY = 'autocomplete:entries'        # hash: product id -> JSON entry
+CHANGES_KEY = 'autocomplete:changes'        # sorted set: product id scored by the version it last changed in
+VERSION_KEY = 'autocomplete:version'        # incremented on every change
+SNAPSHOT_KEY = 'autocomplete:snapshot'      # version of the last full rebuild
+BUILD_LOCK_KEY = 'autocomplete:build-lock'
+
+# Workers further behind than this many changes reload the whole snapshot
+MAX_CHANGE_LOG = 10000
+
+PUBLISH_CHANGE_SCRIPT = """
+local version = redis.call('INCR', KEYS[1])
+if ARGV[2] == '' then
+    redis.call('HDEL', KEYS[2], ARGV[1])
+else
+    redis.call('HSET', KEYS[2], ARGV[1], ARGV[2])
+end
+redis.call('ZADD', KEYS[3], version, ARGV[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[3], '-inf', version - tonumber(ARGV[3]))
+return version
+"""
+
+
+def normalize(text):
+    return ' '.join(text.lower().split())
+
+
+def get_trigrams(text):
+    """Trigrams of a normalized name, padded so word starts get their own trigrams"""
+    padded = f' {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def product_entry(product_id, name, slug, price, sale_price, image):
+    """Build the JSON-ready payload the search endpoint returns for a product"""
+    return [
+        product_id,
+        name,
+        str(sale_price if sale_price else price),
+        f'/product/{slug}/',
+        default_storage.url(image) if image else '',
+    ]
+
+
+class ProductNameIndex:
+    """
+    Trigram index over product names.
+
+    Every product occupies a slot. Slot data is kept in parallel lists and
+    posting lists are arrays of slot numbers, so the index stays compact at
+    hundreds of thousands of products. Removed products leave an empty slot
+    until the index is compacted.
+    """
+
+    def __init__(self, entries=()):
+        self.slots = {}
+        self.names = []
+        self.entries = []
+        self.postings = {}
+        self.removed = 0
+        for entry in entries:
+            self.add(entry)
+
+    def __len__(self):
+        return len(self.slots)
+
+    def add(self, entry):
+        self.remove(entry[0])
+        slot = len(self.entries)
+        name = normalize(entry[1])
+        self.slots[entry[0]] = slot
+        self.names.append(name)
+        self.entries.append(entry)
+        for trigram in get_trigrams(name):
+            posting = self.postings.get(trigram)
+            if posting is None:
+                posting = self.postings[trigram] = array('I')
+            posting.append(slot)
+
+    def remove(self, product_id):
+        slot = self.slots.pop(product_id, None)
+        if slot is None:
+            return
+        self.entries[slot] = None
+        self.removed += 1
+        if self.removed > 1000 and self.removed > len(self.entries) // 4:
+            self.compact()
+
+    def compact(self):
+        live_entries = [entry for entry in self.entries if entry is not None]
+        self.__init__(live_entries)
+
+    def search(self, query, limit=5):
+        query = normalize(query)
+        if len(query) < 2:
+            return []
+        if len(query) == 2:
+            # Too short for a trigram of its own, only match it at the start of a word
+            trigrams = {f' {query}'}
+        else:
+            trigrams = {query[i:i + 3] for i in range(len(query) - 2)}
+        postings = [self.postings.get(trigram) for trigram in trigrams]
+        if not postings or any(posting is None for posting in postings):
+            return []
+        candidates = min(postings, key=len)
+
+        matches = []
+        for slot in candidates:
+            entry = self.entries[slot]
+            if entry is None:
+                continue
+            name = self.names[slot]
+            position = name.find(query)
+            if position == -1:
+                continue
+            if position == 0:
+                rank = 0
+            elif name[position - 1] == ' ':
+                rank = 1
+            else:
+                rank = 2
+            matches.append((rank, len(name), name, slot))
+        matches.sort()
+        return [self.entries[slot] for rank, length, name, slot in matches[:limit]]
+
+
+class Autocomplete:
+    def __init__(self, redis_url=None, max_age=300, sync_interval=1.0):
+        self.redis_url = redis_url
+        self.max_age = max_age
+        self.sync_interval = sync_interval
+        self.index = None
+        self.built_at = 0
+        self.version = 0
+        self.synced_at = 0
+        self.lock = threading.RLock()
+        # Without Redis: the thread rebuilding the index, the changes made while it runs, and the
+        # number of rebuild() calls, which replace whatever it was building from
+        self.refresh_thread = None
+        self.pending_changes = None
+        self.generation = 0
+        self._redis = None
+        self._publish_change = None
+
+    @property
+    def redis(self):
+        if self._redis is None and self.redis_url:
+            import redis
+            self._redis = redis.Redis.from_url(self.redis_url)
+            self._publish_change = self._redis.register_script(PUBLISH_CHANGE_SCRIPT)
+        return self._redis
+
+    def load_entries(self, product_ids=None):
+        from .models import Product
+        products = Product.objects.filter(available=True)
+        if product_ids is not None:
+            products = products.filter(pk__in=product_ids)
+        rows = products.order_by().values_list('id', 'name', 'slug', 'price', 'sale_price', 'image')
+        return [product_entry(*row) for row in rows.iterator(chunk_size=5000)]
+
+    def suggest(self, query, limit=5):
+        """Return up to `limit` entries whose name contains the query, best matches first"""
+        with self.lock:
+            index = self.get_index()
+            return [
+                {'id': entry[0], 'name': entry[1], 'price': entry[2], 'url': entry[3], 'image': entry[4]}
+                for entry in index.search(query, limit)
+            ]
+
+    def get_index(self):
+        now = time.monotonic()
+        if self.redis is not None:
+            if self.index is None or now - self.synced_at >= self.sync_interval:
+                self.synced_at = now
+                try:
+                    self.sync()
+                except RedisError:
+                    logger.exception('Could not sync the autocomplete index from Redis')
+                    if self.index is None:
+                        self.index = ProductNameIndex(self.load_entries())
+        elif self.index is None:
+            self.index = ProductNameIndex(self.load_entries())
+            self.built_at = now
+        elif now - self.built_at >= self.max_age and self.refresh_thread is None:
+            # Without Redis other workers' changes are only picked up by rebuilding, which takes
+            # seconds at 100k products: keep answering from the current index in the meantime
+            self.built_at = now
+            self.pending_changes = {}
+            self.refresh_thread = threading.Thread(
+                target=self.refresh, args=(self.generation,), name='autocomplete-refresh', daemon=True
+            )
+            self.refresh_thread.start()
+        return self.index
+
+    def refresh(self, generation):
+        """Rebuild the index in the background and swap it in, see get_index()"""
+        from django.db import connection
+        index = None
+        try:
+            index = ProductNameIndex(self.load_entries())
+        except Exception:
+            logger.exception('Could not rebuild the autocomplete index')
+        finally:
+            connection.close()
+        with self.lock:
+            if index is not None and generation == self.generation:
+                for product_id, entry in self.pending_changes.items():
+                    if entry is None:
+                        index.remove(product_id)
+                    else:
+                        index.add(entry)
+                self.index = index
+            self.pending_changes = None
+            self.refresh_thread = None
+
+    def rebuild(self):
+        """Rebuild from the database and, with Redis, replace the shared snapshot"""
+        entries = self.load_entries()
+        with self.lock:
+            if self.redis is not None:
+                self.version = self.publish_snapshot(entries)
+            self.index = ProductNameIndex(entries)
+            self.built_at = time.monotonic()
+            self.generation += 1
+        return len(entries)
+
+    def publish_snapshot(self, entries):
+        temporary_key = f'{ENTRIES_KEY}:building'
+        pipeline = self.redis.pipeline()
+        pipeline.delete(temporary_key)
+        for start in range(0, len(entries), 5000):
+            pipeline.hset(temporary_key, mapping={
+                entry[0]: json.dumps(entry) for entry in entries[start:start + 5000]
+            })
+        if entries:
+            pipeline.rename(temporary_key, ENTRIES_KEY)
+        else:
+            pipeline.delete(ENTRIES_KEY)
+        pipeline.incr(VERSION_KEY)
+        version = pipeline.execute()[-1]
+        self.redis.set(SNAPSHOT_KEY, version)
+        return version
+
+    def sync(self):
+        """Bring the local index up to date with the shared snapshot in Redis"""
+        version, snapshot = (int(value or 0) for value in self.redis.mget(VERSION_KEY, SNAPSHOT_KEY))
+        if not snapshot:
+            # Nobody has published an index yet, build it once for everyone
+            if self.redis.set(BUILD_LOCK_KEY, 1, nx=True, ex=60):
+                try:
+                    self.rebuild()
+                finally:
+                    self.redis.delete(BUILD_LOCK_KEY)
+            elif self.index is None:
+                self.index = ProductNameIndex(self.load_entries())
+            return
+        if self.index is None or self.version < snapshot or version - self.version > MAX_CHANGE_LOG:
+            entries = [json.loads(value) for value in self.redis.hvals(ENTRIES_KEY)]
+            self.index = ProductNameIndex(entries)
+            self.version = version
+            return
+        if version == self.version:
+            return
+        changes = self.redis.zrangebyscore(CHANGES_KEY, f'({self.version}', '+inf', withscores=True)
+        if changes:
+            product_ids = [int(product_id) for product_id, score in changes]
+            for product_id, value in zip(product_ids, self.redis.hmget(ENTRIES_KEY, product_ids)):
+                if value is None:
+                    self.index.remove(product_id)
+                else:
+                    self.index.add(json.loads(value))
+            version = max(version, int(max(score for product_id, score in changes)))
+        self.version = version
+
+    def apply_change(self, product_id, entry):
+        with self.lock:
+            if self.pending_changes is not None:
+                self.pending_changes[product_id] = entry
+            if self.index is not None:
+                if entry is None:
+                    self.index.remove(product_id)
+                else:
+                    self.index.add(entry)
+        if self.redis is not None:
+            try:
+                self._publish_change(
+                    keys=[VERSION_KEY, ENTRIES_KEY, CHANGES_KEY],
+                    args=[product_id, json.dumps(entry) if entry else '', MAX_CHANGE_LOG],
+                )
+            except RedisError:
+                logger.exception('Could not publish autocomplete change for product %s', product_id)
+
+    def product_saved(self, product):
+        entry = None
+        if product.available:
+            entry = product_entry(
+                product.pk, product.name, product.slug, product.price, product.sale_price, product.image.name
+            )
+        self.apply_change(product.pk, entry)
+
+    def product_deleted(self, product_id):
+        self.apply_change(product_id, None)
+
+    def products_updated(self, product_ids):
+        """Reload products changed by a bulk UPDATE, which sends no signals"""
+        entries = {entry[0]: entry for entry in self.load_entries(product_ids)}
+        for product_id in product_ids:
+            self.apply_change(product_id, entries.get(product_id))
+
+
+autocomplete = Autocomplete(
+    redis_url=getattr(settings, 'AUTOCOMPLETE_REDIS_URL', None),
+    max_age=getattr(settings, 'AUTOCOMPLETE_MAX_AGE', 300),
+)
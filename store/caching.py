@@ -0,0 +1,110 @@
+"""
+Cache helpers shared by the store's cached lookups.
+
+Each cached lookup belongs to a namespace whose version number lives in the
+default cache. Bumping the version invalidates everything computed under the
+old one, including values memoized inside each worker process, which then only
+pay a single small cache read to find out whether they are still current.
+"""
+import threading
+import time
+
+from django.core.cache import cache
+
+
+def version_key(namespace):
+    return f'version:{namespace}'
+
+
+def get_version(namespace):
+    key = version_key(namespace)
+    version = cache.get(key)
+    if version is None:
+        # Start from the clock so a version evicted from the cache never goes backwards
+        cache.add(key, int(time.time() * 1000), None)
+        version = cache.get(key, 0)
+    return version
+
+
+def bump_version(namespace):
+    key = version_key(namespace)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        get_version(namespace)
+        return cache.incr(key)
+
+
+class ProcessMemo:
+    """
+    Values memoized in this process, valid while their namespace version is
+    unchanged and, when a timeout is given, for at most `timeout` seconds.
+    """
+
+    def __init__(self, namespace, timeout=None):
+        self.namespace = namespace
+        self.timeout = timeout
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def get(self, key, compute):
+        version = get_version(self.namespace)
+        now = time.monotonic()
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] == version and (entry[1] is None or entry[1] > now):
+            return entry[2]
+        value = compute()
+        expires = now + self.timeout if self.timeout is not None else None
+        with self.lock:
+            self.entries[key] = (version, expires, value)
+        return value
+
+    def discard(self, key):
+        """Forget this process' copy of one value, leaving other processes alone"""
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def invalidate(self):
+        bump_version(self.namespace)
+        with self.lock:
+            self.entries.clear()
+
+
+class HitCounter:
+    """
+    Cache hit and miss counts. Each process counts locally and adds its counts
+    to totals shared through the cache every `flush_every` lookups.
+    """
+
+    def __init__(self, namespace, flush_every=100):
+        self.namespace = namespace
+        self.flush_every = flush_every
+        self.pending = {'hits': 0, 'misses': 0}
+        self.lock = threading.Lock()
+
+    def key(self, outcome):
+        return f'stats:{self.namespace}:{outcome}'
+
+    def hit(self):
+        self.record('hits')
+
+    def miss(self):
+        self.record('misses')
+
+    def record(self, outcome):
+        with self.lock:
+            self.pending[outcome] += 1
+            if sum(self.pending.values()) < self.flush_every:
+                return
+            pending, self.pending = self.pending, {'hits': 0, 'misses': 0}
+        for outcome, count in pending.items():
+            if count:
+                cache.add(self.key(outcome), 0, None)
+                cache.incr(self.key(outcome), count)
+
+    def totals(self):
+        """Shared totals, not including lookups this process hasn't flushed yet"""
+        return {outcome: cache.get(self.key(outcome), 0) for outcome in ('hits', 'misses')}
+
+    def reset(self):
+        cache.delete_many([self.key('hits'), self.key('misses')])
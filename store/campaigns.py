@@ -0,0 +1,103 @@
+"""
+Flash sale prices.
+
+When a campaign starts, the sale price of every product in it is replaced by
+the campaign's price in one UPDATE, and the price it replaced is kept in a
+FlashSalePriceAudit row. When the campaign ends, is switched off or deleted,
+the audited prices are put back the same way, except on products whose sale
+price was changed by hand in the meantime.
+
+sync_campaign_prices() brings one campaign's prices in line with its
+schedule. The store.tasks Celery tasks run it when campaigns or their items
+change and sweep for campaigns due to start or end every minute.
+"""
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q, Subquery
+from django.utils import timezone
+
+from .autocomplete import autocomplete
+from .models import FlashSaleCampaign, FlashSaleItem, FlashSalePriceAudit, Product
+from .page_cache import invalidate_page_tags, product_tags
+
+
+def apply_campaign_prices(campaign, now=None):
+    """Give every product in the campaign its flash sale price, returning the changed product ids"""
+    now = now or timezone.now()
+    items = FlashSaleItem.objects.filter(campaign=campaign)
+    audits = FlashSalePriceAudit.objects.filter(campaign=campaign, reverted_at__isnull=True)
+    with transaction.atomic():
+        # Products taken out of the campaign since its prices were applied
+        changed = revert_campaign_prices(campaign, now, audits.exclude(product_id__in=items.values('product_id')))
+
+        FlashSalePriceAudit.objects.bulk_create([
+            FlashSalePriceAudit(
+                campaign=campaign, product_id=product_id,
+                previous_sale_price=previous_sale_price, applied_sale_price=sale_price,
+            )
+            for product_id, sale_price, previous_sale_price in items.exclude(
+                product_id__in=audits.values('product_id')
+            ).values_list('product_id', 'sale_price', 'product__sale_price')
+        ])
+        item_price = Subquery(items.filter(product_id=OuterRef('product_id')).values('sale_price')[:1])
+        audits.update(applied_sale_price=item_price)
+
+        products = Product.objects.filter(pk__in=items.values('product_id'))
+        changed += list(products.values_list('pk', flat=True))
+        products.update(
+            sale_price=Subquery(items.filter(product_id=OuterRef('pk')).values('sale_price')[:1]),
+            updated_at=now,
+        )
+        FlashSaleCampaign.objects.filter(pk=campaign.pk).update(prices_applied_at=now, prices_reverted_at=None)
+    transaction.on_commit(lambda: autocomplete.products_updated(changed))
+    transaction.on_commit(lambda: invalidate_page_tags('catalogue', *product_tags(changed)))
+    return changed
+
+
+def revert_campaign_prices(campaign, now=None, audits=None):
+    """Put back the sale prices replaced by the campaign, returning the changed product ids"""
+    now = now or timezone.now()
+    if audits is None:
+        audits = FlashSalePriceAudit.objects.filter(campaign=campaign, reverted_at__isnull=True)
+    with transaction.atomic():
+        # Leave alone products whose sale price was edited while the campaign ran
+        still_applied = audits.filter(product_id=OuterRef('pk'), applied_sale_price=OuterRef('sale_price'))
+        products = Product.objects.filter(Exists(still_applied))
+        changed = list(products.values_list('pk', flat=True))
+        products.update(sale_price=Subquery(still_applied.values('previous_sale_price')[:1]), updated_at=now)
+        audits.update(reverted_at=now)
+    transaction.on_commit(lambda: autocomplete.products_updated(changed))
+    transaction.on_commit(lambda: invalidate_page_tags('catalogue', *product_tags(changed)))
+    return changed
+
+
+def campaign_is_running(campaign, now):
+    return campaign.is_active and campaign.start_date <= now <= campaign.end_date
+
+
+def unreverted_audits(campaign=None):
+    """Audits of prices still applied, of `campaign` or of the campaign in OuterRef('pk') by default"""
+    return FlashSalePriceAudit.objects.filter(
+        campaign=campaign if campaign is not None else OuterRef('pk'), reverted_at__isnull=True
+    )
+
+
+def sync_campaign_prices(campaign, now=None):
+    now = now or timezone.now()
+    if campaign_is_running(campaign, now):
+        return apply_campaign_prices(campaign, now)
+    # The audits tell whether prices are applied, whatever the campaign's timestamps say
+    if unreverted_audits(campaign).exists():
+        changed = revert_campaign_prices(campaign, now)
+        FlashSaleCampaign.objects.filter(pk=campaign.pk).update(prices_reverted_at=now)
+        return changed
+    return []
+
+
+def campaigns_due(now=None):
+    """Campaigns that have started without their prices applied, or stopped with them still applied"""
+    now = now or timezone.now()
+    running = Q(is_active=True, start_date__lte=now, end_date__gte=now)
+    return FlashSaleCampaign.objects.filter(
+        (running & Q(prices_applied_at__isnull=True))
+        | (~running & Exists(unreverted_audits()))
+    )
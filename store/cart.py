@@ -0,0 +1,70 @@
+"""
+Cart summary shown in the navbar of every page.
+
+The summary is lazy: nothing is read until a template asks for the item count
+or total, it is computed with one aggregate query, and it never creates a
+Cart. Summaries are cached per user or session and dropped by the cart
+signals in store.signals whenever the cart changes.
+"""
+from decimal import Decimal
+
+from django.core.cache import cache
+
+from .models import CartItem
+
+SUMMARY_TIMEOUT = 5 * 60
+EMPTY_TOTALS = {'total_items': 0, 'total_price': Decimal('0.00')}
+
+
+def get_summary_cache_key(user_id=None, session_key=None):
+    if user_id:
+        return f'cart-summary:user:{user_id}'
+    if session_key:
+        return f'cart-summary:session:{session_key}'
+    return None
+
+
+def invalidate_cart_summary(user_id=None, session_key=None):
+    keys = [
+        get_summary_cache_key(user_id=user_id),
+        get_summary_cache_key(session_key=session_key),
+    ]
+    cache.delete_many([key for key in keys if key])
+
+
+class CartSummary:
+    def __init__(self, request):
+        self.request = request
+        self._totals = None
+
+    def get_items(self):
+        """Items of the visitor's cart, or None if they cannot have one yet"""
+        if self.request.user.is_authenticated:
+            return CartItem.objects.filter(cart__user=self.request.user)
+        session_key = self.request.session.session_key
+        if session_key:
+            return CartItem.objects.filter(cart__session_key=session_key)
+        return None
+
+    def get_cache_key(self):
+        if self.request.user.is_authenticated:
+            return get_summary_cache_key(user_id=self.request.user.pk)
+        return get_summary_cache_key(session_key=self.request.session.session_key)
+
+    @property
+    def totals(self):
+        if self._totals is None:
+            cache_key = self.get_cache_key()
+            totals = cache.get(cache_key) if cache_key else EMPTY_TOTALS
+            if totals is None:
+                items = self.get_items()
+                totals = items.totals() if items is not None else EMPTY_TOTALS
+                cache.set(cache_key, totals, SUMMARY_TIMEOUT)
+            self._totals = totals
+        return self._totals
+
+    def get_total_items(self):
+        return self.totals['total_items']
+
+    def get_total_price(self):
+        return self.totals['total_price']
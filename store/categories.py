@@ -0,0 +1,20 @@
+"""
+Category list shared by the navbar, the product search form and listing views.
+
+Categories rarely change, so each worker keeps the materialized list and only
+checks a version number in the shared cache, which Category saves and deletes
+bump (see store.signals).
+"""
+from .caching import ProcessMemo
+from .models import Category
+
+category_memo = ProcessMemo('categories')
+
+
+def get_categories():
+    """All categories in their default (name) order, as a list"""
+    return category_memo.get('all', lambda: list(Category.objects.all()))
+
+
+def invalidate_categories():
+    category_memo.invalidate()
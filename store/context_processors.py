@@ -1,9 +1,11 @@
-from .models import Category, Cart
+from .cart import CartSummary
+from .categories import get_categories
+from .page_cache import PlaceholderCart
 
 def categories_processor(request):
     """Make categories available in all templates"""
     try:
-        categories = Category.objects.all()
+        categories = get_categories()
     except Exception:
         categories = []
     
@@ -12,20 +14,10 @@ def categories_processor(request):
     }
 
 def cart_processor(request):
-    """Make cart available in all templates"""
-    cart = None
-    try:
-        if request.user.is_authenticated:
-            cart, created = Cart.objects.get_or_create(user=request.user)
-        else:
-            # For anonymous users, we'll use session-based cart
-            session_key = request.session.session_key
-            if session_key:
-                cart, created = Cart.objects.get_or_create(session_key=session_key)
-    except Exception:
-        # If there's any error, just return None for cart
-        cart = None
-    
+    """Make a lazy summary of the visitor's cart available in all templates"""
+    if hasattr(request, 'page_tags'):
+        # Rendering a page for the anonymous page cache, which fills in the count per visitor
+        return {'cart': PlaceholderCart()}
     return {
-        'cart': cart,
+        'cart': CartSummary(request),
     }
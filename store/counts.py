@@ -0,0 +1,75 @@
+"""
+Result counts for the product listings.
+
+Counting a filtered listing scans every matching row, and the AJAX listing
+asked for the count on every page fetch. Counts are now cached for a short
+while per normalized filter combination. On PostgreSQL, result sets the
+planner expects to be large aren't counted at all: the planner's row
+estimate is shown instead, rounded down as "20,000+".
+"""
+import hashlib
+import json
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import connections
+
+COUNT_TIMEOUT = 60
+APPROXIMATE_COUNT_ABOVE = 10000
+
+
+class ResultCount:
+    def __init__(self, value, approximate=False):
+        self.value = value
+        self.approximate = approximate
+
+    def __str__(self):
+        if not self.approximate:
+            return str(self.value)
+        magnitude = 10 ** (len(str(self.value)) - 1)
+        return f'{self.value // magnitude * magnitude:,}+'
+
+
+def normalize_filter(value):
+    if isinstance(value, str):
+        return ' '.join(value.lower().split())
+    if isinstance(value, Decimal):
+        return str(value.normalize())
+    return value
+
+
+def get_count_key(signature):
+    normalized = {name: normalize_filter(value) for name, value in signature.items() if value not in (None, '')}
+    digest = hashlib.md5(json.dumps(normalized, sort_keys=True, default=str).encode()).hexdigest()
+    return f'product-count:{digest}'
+
+
+def estimate_rows(queryset):
+    """The planner's row estimate for a queryset, or None where there is no cheap estimate"""
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    sql, params = queryset.order_by().values('pk').query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def count_results(queryset, signature):
+    """
+    Count `queryset`, the listing filtered by the values in `signature`
+    (e.g. query, category and price range), which identify the cached count.
+    """
+    key = get_count_key(signature)
+    result = cache.get(key)
+    if result is None:
+        estimate = estimate_rows(queryset)
+        if estimate is not None and estimate > APPROXIMATE_COUNT_ABOVE:
+            result = ResultCount(estimate, approximate=True)
+        else:
+            result = ResultCount(queryset.order_by().count())
+        cache.set(key, result, COUNT_TIMEOUT)
+    return result
@@ -1,6 +1,11 @@
+from functools import wraps
+
 from django.contrib.auth.decorators import user_passes_test
 from django.contrib import messages
 from django.shortcuts import redirect
+from django.utils.cache import get_conditional_response
+
+from .page_cache import get_tag_versions, page_etag, visitor_tags
 
 def is_delivery_man(user):
     return user.is_authenticated and user.groups.filter(name='DeliveryGroup').exists()
@@ -32,3 +37,33 @@ def staff_required(function=None, redirect_field_name=None, login_url='account_l
     if function:
         return actual_decorator(function)
     return actual_decorator
+
+def conditional_page(get_validators):
+    """
+    Decorator for catalogue views that answers conditional GETs with 304 Not
+    Modified without running the view. get_validators(request, *args, **kwargs)
+    returns the page tags the view's response depends on (see
+    store.page_cache) and a list of other values that change with it, such as
+    the latest updated_at of the products shown, or None when the response
+    can't be validated cheaply.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            # Pages rendered for the anonymous page cache get their ETag from it
+            if request.method not in ('GET', 'HEAD') or hasattr(request, 'page_tags') or 'messages' in request.COOKIES:
+                return view(request, *args, **kwargs)
+            validators = get_validators(request, *args, **kwargs)
+            if validators is None:
+                return view(request, *args, **kwargs)
+            tags, values = validators
+            etag = page_etag(request, get_tag_versions([*tags, *visitor_tags(request)]), *values)
+            response = get_conditional_response(request, etag=etag)
+            if response is None:
+                response = view(request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+            response['ETag'] = etag
+            return response
+        return wrapper
+    return decorator
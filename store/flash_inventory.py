@@ -0,0 +1,319 @@
+"""
+Flash-sale inventory.
+
+Each FlashSaleItem has a limited allocation (quantity_available) that orders
+claim from. Claims are all-or-nothing across the items of an order and can
+never take an allocation below zero:
+
+* DatabaseInventory, the default, claims with one conditional UPDATE
+  (quantity_available >= quantity) so the row itself is the counter.
+* RedisInventory keeps the counters in Redis when FLASH_SALE_REDIS_URL (or
+  REDIS_URL) is set. Claims are checked and decremented by a Lua script and
+  recorded as pending deltas that the reconcile_flash_sales command writes
+  back to quantity_available.
+* MemoryInventory does the same with counters local to one process, for
+  development and tests.
+"""
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import Case, F, Value, When
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .flash_sales import invalidate_flash_sales
+from .models import FlashSaleItem, OutOfStock
+
+COUNTER_KEY = 'flash-sale:left:{}'     # units left of an item's allocation
+CLAIMED_KEY = 'flash-sale:claimed'     # hash: item id -> units claimed since the last reconcile
+
+# KEYS[1] is the claimed hash, KEYS[i + 1] the counter of item i.
+# ARGV holds (item id, quantity) pairs in the same order.
+CLAIM_SCRIPT = """
+local count = #KEYS - 1
+for i = 1, count do
+    local left = redis.call('GET', KEYS[i + 1])
+    if not left then
+        return -i
+    end
+    if tonumber(left) < tonumber(ARGV[2 * i]) then
+        return i
+    end
+end
+for i = 1, count do
+    redis.call('DECRBY', KEYS[i + 1], ARGV[2 * i])
+    redis.call('HINCRBY', KEYS[1], ARGV[2 * i - 1], ARGV[2 * i])
+end
+return 0
+"""
+
+RELEASE_SCRIPT = """
+for i = 1, #KEYS - 1 do
+    if redis.call('EXISTS', KEYS[i + 1]) == 1 then
+        redis.call('INCRBY', KEYS[i + 1], ARGV[2 * i])
+        redis.call('HINCRBY', KEYS[1], ARGV[2 * i - 1], -tonumber(ARGV[2 * i]))
+    end
+end
+"""
+
+# ARGV[3] is 1 to replace a counter already there
+SEED_SCRIPT = """
+local claimed = tonumber(redis.call('HGET', KEYS[1], ARGV[1]) or '0')
+local left = math.max(tonumber(ARGV[2]) - claimed, 0)
+if ARGV[3] == '1' then
+    redis.call('SET', KEYS[2], left)
+else
+    redis.call('SET', KEYS[2], left, 'NX')
+end
+"""
+
+TAKE_CLAIMED_SCRIPT = """
+local claimed = redis.call('HGETALL', KEYS[1])
+redis.call('DEL', KEYS[1])
+return claimed
+"""
+
+
+class FlashSaleSoldOut(OutOfStock):
+    message = 'The flash sale has sold out for'
+
+
+def write_back_claims(claimed):
+    """Subtract {item_id: units} from quantity_available in one UPDATE"""
+    claimed = {item_id: units for item_id, units in claimed.items() if units}
+    if not claimed:
+        return 0
+    units = Case(
+        *[When(pk=item_id, then=Value(count)) for item_id, count in claimed.items()],
+        output_field=models.IntegerField(),
+    )
+    FlashSaleItem.objects.filter(pk__in=claimed).update(
+        quantity_available=Greatest(F('quantity_available') - units, Value(0))
+    )
+    invalidate_flash_sales()
+    return len(claimed)
+
+
+class DatabaseInventory:
+    def claim(self, quantities):
+        """Claim {item_id: quantity}, returning the ids of the items that fell short"""
+        needed = Case(
+            *[When(pk=item_id, then=Value(quantity)) for item_id, quantity in quantities.items()],
+            output_field=models.PositiveIntegerField(),
+        )
+        try:
+            with transaction.atomic():
+                updated = FlashSaleItem.objects.filter(
+                    pk__in=quantities, quantity_available__gte=needed
+                ).update(quantity_available=F('quantity_available') - needed)
+                if updated != len(quantities):
+                    raise FlashSaleSoldOut([])
+        except FlashSaleSoldOut:
+            return [
+                item_id for item_id, left in
+                FlashSaleItem.objects.filter(pk__in=quantities).values_list('pk', 'quantity_available')
+                if left < quantities[item_id]
+            ]
+        return []
+
+    def release(self, quantities):
+        """Claims are made in the order's transaction and rolled back with it"""
+
+    def reset(self, item_id, quantity):
+        """quantity_available is the counter itself, nothing to reset"""
+
+    def remove(self, item_id):
+        pass
+
+    def reconcile(self):
+        return 0
+
+
+class MemoryInventory:
+    """Counters local to this process, only correct with a single worker process"""
+
+    def __init__(self):
+        self.left = {}
+        self.claimed = defaultdict(int)
+        self.lock = threading.Lock()
+
+    def seed(self, item_ids):
+        missing = [item_id for item_id in item_ids if item_id not in self.left]
+        if missing:
+            rows = FlashSaleItem.objects.filter(pk__in=missing).values_list('pk', 'quantity_available')
+            for item_id, quantity in rows:
+                self.left.setdefault(item_id, max(quantity - self.claimed[item_id], 0))
+
+    def claim(self, quantities):
+        with self.lock:
+            self.seed(quantities)
+            short = [
+                item_id for item_id, quantity in quantities.items()
+                if self.left.get(item_id, 0) < quantity
+            ]
+            if short:
+                return short
+            for item_id, quantity in quantities.items():
+                self.left[item_id] -= quantity
+                self.claimed[item_id] += quantity
+        return []
+
+    def release(self, quantities):
+        with self.lock:
+            for item_id, quantity in quantities.items():
+                if item_id in self.left:
+                    self.left[item_id] += quantity
+                    self.claimed[item_id] -= quantity
+
+    def reset(self, item_id, quantity):
+        """Restart the counter from a new allocation, less the claims not written back to it yet"""
+        with self.lock:
+            self.left[item_id] = max(quantity - self.claimed[item_id], 0)
+
+    def remove(self, item_id):
+        with self.lock:
+            self.left.pop(item_id, None)
+            self.claimed.pop(item_id, None)
+
+    def reconcile(self):
+        with self.lock:
+            claimed, self.claimed = self.claimed, defaultdict(int)
+        try:
+            return write_back_claims(claimed)
+        except Exception:
+            with self.lock:
+                for item_id, units in claimed.items():
+                    self.claimed[item_id] += units
+            raise
+
+
+class RedisInventory:
+    def __init__(self, redis_url=None, client=None):
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(redis_url)
+        self.redis = client
+        self._claim = client.register_script(CLAIM_SCRIPT)
+        self._release = client.register_script(RELEASE_SCRIPT)
+        self._seed = client.register_script(SEED_SCRIPT)
+        self._take_claimed = client.register_script(TAKE_CLAIMED_SCRIPT)
+
+    def get_script_arguments(self, quantities):
+        item_ids = list(quantities)
+        keys = [CLAIMED_KEY] + [COUNTER_KEY.format(item_id) for item_id in item_ids]
+        args = []
+        for item_id in item_ids:
+            args += [item_id, quantities[item_id]]
+        return item_ids, keys, args
+
+    def seed(self, item_id, quantity=None, replace=False):
+        if quantity is None:
+            quantity = FlashSaleItem.objects.filter(pk=item_id).values_list('quantity_available', flat=True).first()
+        self._seed(keys=[CLAIMED_KEY, COUNTER_KEY.format(item_id)], args=[item_id, quantity or 0, int(replace)])
+
+    def claim(self, quantities):
+        item_ids, keys, args = self.get_script_arguments(quantities)
+        for attempt in range(len(item_ids) + 1):
+            result = self._claim(keys=keys, args=args)
+            if result >= 0:
+                break
+            # First claim on this item since Redis was emptied, load its counter from the database
+            self.seed(item_ids[-result - 1])
+        if result == 0:
+            return []
+        return [item_ids[abs(result) - 1]]
+
+    def release(self, quantities):
+        item_ids, keys, args = self.get_script_arguments(quantities)
+        self._release(keys=keys, args=args)
+
+    def reset(self, item_id, quantity):
+        """Restart the counter from a new allocation, less the claims not written back to it yet"""
+        self.seed(item_id, quantity, replace=True)
+
+    def remove(self, item_id):
+        pipeline = self.redis.pipeline()
+        pipeline.hdel(CLAIMED_KEY, item_id)
+        pipeline.delete(COUNTER_KEY.format(item_id))
+        pipeline.execute()
+
+    def reconcile(self):
+        flat = self._take_claimed(keys=[CLAIMED_KEY])
+        claimed = {int(flat[i]): int(flat[i + 1]) for i in range(0, len(flat), 2)}
+        try:
+            return write_back_claims(claimed)
+        except Exception:
+            # Put the claims back so the next reconcile writes them
+            pipeline = self.redis.pipeline()
+            for item_id, units in claimed.items():
+                pipeline.hincrby(CLAIMED_KEY, item_id, units)
+            pipeline.execute()
+            raise
+
+
+_inventory = None
+
+
+def get_flash_inventory():
+    global _inventory
+    if _inventory is None:
+        backend_path = getattr(settings, 'FLASH_SALE_INVENTORY_BACKEND', None)
+        redis_url = getattr(settings, 'FLASH_SALE_REDIS_URL', None)
+        if backend_path:
+            _inventory = import_string(backend_path)()
+        elif redis_url:
+            _inventory = RedisInventory(redis_url)
+        else:
+            _inventory = DatabaseInventory()
+    return _inventory
+
+
+def get_active_flash_items(product_ids):
+    """Map product ids to the FlashSaleItem of the campaign running right now"""
+    now = timezone.now()
+    return dict(FlashSaleItem.objects.filter(
+        product_id__in=product_ids,
+        campaign__is_active=True,
+        campaign__start_date__lte=now,
+        campaign__end_date__gte=now,
+    ).values_list('product_id', 'pk'))
+
+
+@contextmanager
+def flash_sale_claims(lines):
+    """
+    Claim flash-sale allocations for (product, quantity) order lines, raising
+    FlashSaleSoldOut if any is exhausted, and run the block in a transaction
+    with them. Claims are released again if the block raises or the
+    transaction fails to commit.
+    """
+    lines = list(lines)
+    items = get_active_flash_items({product.pk for product, quantity in lines})
+    quantities = defaultdict(int)
+    products = {}
+    for product, quantity in lines:
+        item_id = items.get(product.pk)
+        if item_id is not None:
+            quantities[item_id] += quantity
+            products[item_id] = product
+    inventory = get_flash_inventory()
+    claimed = False
+    try:
+        with transaction.atomic():
+            if quantities:
+                short = inventory.claim(dict(quantities))
+                if short:
+                    # Stop advertising the sold out products as on sale
+                    invalidate_flash_sales()
+                    raise FlashSaleSoldOut([products[item_id] for item_id in short])
+                claimed = True
+            yield
+    except BaseException:
+        # After the rollback, so a failed database transaction doesn't stop counters elsewhere being released
+        if claimed:
+            inventory.release(dict(quantities))
+        raise
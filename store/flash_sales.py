@@ -0,0 +1,57 @@
+"""
+Which flash sale is running right now.
+
+Each worker keeps the active campaign and the ids of the products on sale in
+it until the next scheduled start or end of any campaign, so pages showing
+flash sale state don't query campaigns in between. Campaign and item changes
+bump the shared version (see store.signals), and so does a claim finding an
+allocation sold out, which drops the product's flash sale badge.
+"""
+from collections import namedtuple
+
+from django.db.models import Min, Q
+from django.utils import timezone
+
+from .caching import ProcessMemo
+from .models import FlashSaleCampaign, FlashSaleItem
+from .page_cache import invalidate_page_tags
+
+# Allocations also run out through claims, which don't signal, so never trust a copy for long
+ACTIVE_FLASH_SALE_TIMEOUT = 60
+
+ActiveFlashSale = namedtuple('ActiveFlashSale', ['campaign', 'product_ids', 'valid_until'])
+
+flash_sale_memo = ProcessMemo('flash-sales', timeout=ACTIVE_FLASH_SALE_TIMEOUT)
+
+
+def load_active_flash_sale(now):
+    running = Q(is_active=True, start_date__lte=now, end_date__gte=now)
+    campaign = FlashSaleCampaign.objects.filter(running).first()
+    product_ids = frozenset(FlashSaleItem.objects.filter(
+        quantity_available__gt=0,
+        campaign__is_active=True,
+        campaign__start_date__lte=now,
+        campaign__end_date__gte=now,
+    ).values_list('product_id', flat=True))
+    boundaries = FlashSaleCampaign.objects.filter(is_active=True).aggregate(
+        next_start=Min('start_date', filter=Q(start_date__gt=now)),
+        next_end=Min('end_date', filter=Q(end_date__gte=now)),
+    )
+    valid_until = min((boundary for boundary in boundaries.values() if boundary is not None), default=None)
+    return ActiveFlashSale(campaign, product_ids, valid_until)
+
+
+def get_active_flash_sale():
+    """The running campaign (or None) and the ids of products with allocation left"""
+    now = timezone.now()
+    active = flash_sale_memo.get('active', lambda: load_active_flash_sale(now))
+    if active.valid_until is not None and now >= active.valid_until:
+        # A campaign started or ended since this copy was loaded
+        flash_sale_memo.discard('active')
+        active = flash_sale_memo.get('active', lambda: load_active_flash_sale(now))
+    return active
+
+
+def invalidate_flash_sales():
+    flash_sale_memo.invalidate()
+    invalidate_page_tags('flash-sales')
@@ -153,8 +153,8 @@ class ProductSearchForm(forms.Form):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        from .models import Category
-        categories = Category.objects.all()
+        from .categories import get_categories
+        categories = get_categories()
         self.fields['category'].choices = [('', 'All Categories')] + [
             (cat.slug, cat.name) for cat in categories
         ]
@@ -0,0 +1,84 @@
+"""
+Resized derivatives of uploaded images.
+
+Uploads used to be served at their original size, often several megabytes,
+into 200px card slots. Every uploaded image now gets a derivative per size in
+SIZES, in its own format (JPEG, or PNG when it has transparency) and as WebP,
+written next to the original: by the generate_image_derivatives task when an
+image is uploaded, and by the command of the same name for existing images.
+The derivatives' names are recorded in the model's image_variants along with
+the image they were made from, and get_image_source()/get_image_srcset()
+serve them from there until the image is replaced.
+"""
+import os
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.db.models import Q
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from .models import Ad, Category, Product, ProductImage
+
+SIZES = {'thumb': 150, 'card': 400, 'detail': 1000}  # widths in pixels
+JPEG_QUALITY = 82
+WEBP_QUALITY = 80
+IMAGE_MODELS = (Product, ProductImage, Category, Ad)
+
+
+def derivative_name(name, size, extension):
+    root, _ = os.path.splitext(name)
+    return f'{root}.{size}.{extension}'
+
+
+def save_image(storage, name, image, image_format, **options):
+    buffer = BytesIO()
+    image.save(buffer, image_format, **options)
+    # Replace the derivative of an earlier upload under the same name
+    storage.delete(name)
+    return storage.save(name, ContentFile(buffer.getvalue()))
+
+
+def write_derivatives(storage, name):
+    """Write every size of the image `name` in `storage`, returning its image_variants record"""
+    with storage.open(name, 'rb') as original:
+        image = ImageOps.exif_transpose(Image.open(original))
+        image.load()
+    transparent = image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+    image = image.convert('RGBA' if transparent else 'RGB')
+    if transparent:
+        fallback_format, extension, options = 'PNG', 'png', {'optimize': True}
+    else:
+        fallback_format, extension, options = 'JPEG', 'jpg', {'quality': JPEG_QUALITY, 'optimize': True, 'progressive': True}
+
+    sizes = {}
+    for size, width in SIZES.items():
+        resized = image
+        if image.width > width:
+            resized = image.resize((width, max(round(image.height * width / image.width), 1)), Image.LANCZOS)
+        sizes[size] = {
+            'width': resized.width,
+            'src': save_image(storage, derivative_name(name, size, extension), resized, fallback_format, **options),
+            'webp': save_image(storage, derivative_name(name, size, 'webp'), resized, 'WEBP', quality=WEBP_QUALITY, method=4),
+        }
+    return {'name': name, 'sizes': sizes}
+
+
+def record_derivatives(model, pk, variants):
+    """Store the variants on the object, unless its image was replaced while they were written"""
+    now = timezone.now()
+    updates = {'image_variants': variants}
+    if any(field.name == 'updated_at' for field in model._meta.fields):
+        updates['updated_at'] = now
+    # Rows showing an image_url keep the variants of its local copy, see store.mirror
+    updated = model.objects.filter(
+        Q(image_url='') | Q(image_url__isnull=True), pk=pk, image=variants['name']
+    ).update(**updates)
+    if updated and model is Product:
+        Product.objects.filter(pk=pk).refresh_primary_images()
+    elif updated and model is ProductImage:
+        # Cached product cards are keyed on the product's updated_at
+        products = Product.objects.filter(images=pk)
+        products.update(updated_at=now)
+        products.refresh_primary_images()
+    return updated
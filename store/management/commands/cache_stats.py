@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from store.page_cache import page_stats
+from store.templatetags.product_cards import card_stats
+
+
+class Command(BaseCommand):
+    help = 'Show hit and miss counts of the anonymous page cache and the product card fragment cache (each process reports every 100 lookups)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Reset the counts after showing them')
+
+    def handle(self, *args, **options):
+        for counter in (page_stats, card_stats):
+            totals = counter.totals()
+            lookups = totals['hits'] + totals['misses']
+            ratio = totals['hits'] / lookups if lookups else 0
+            self.stdout.write(
+                f"{counter.namespace}: {totals['hits']} hits, {totals['misses']} misses ({ratio:.0%} hit rate)"
+            )
+            if options['reset']:
+                counter.reset()
@@ -1,13 +1,25 @@
 from django.core.management.base import BaseCommand
 from django.contrib.auth.models import User
-from store.models import Category, Product
+from store.autocomplete import autocomplete
+from store.models import PLACEHOLDER_IMAGE, Category, Product
+from store.page_cache import invalidate_page_tags
+from store.recommendations import product_sampler
+from store.slugs import allocate_slugs, retry_on_conflict
 from decimal import Decimal
 import random
 
+GENERATED_BATCH_SIZE = 1000
+
 
 class Command(BaseCommand):
     help = 'Create sample data for the e-commerce site'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--products', type=int, default=0,
+            help='Also create this many products copied from the samples, to try the catalogue at scale'
+        )
+
     def handle(self, *args, **options):
         self.stdout.write('Creating sample data...')
 
@@ -141,6 +153,28 @@ class Command(BaseCommand):
             if created:
                 self.stdout.write(f'Created product: {product.name}')
 
+        if options['products']:
+            self.create_generated_products(options['products'], products_data)
+            self.stdout.write(f'Created {options["products"]} generated products')
+
         self.stdout.write(
             self.style.SUCCESS('Successfully created sample data!')
         )
+
+    def create_generated_products(self, count, products_data):
+        """Copies of random sample products, numbered "laptop-pro-1", "laptop-pro-2"... and written in bulk"""
+        for start in range(0, count, GENERATED_BATCH_SIZE):
+            samples = [random.choice(products_data) for _ in range(min(GENERATED_BATCH_SIZE, count - start))]
+
+            def write():
+                slugs = allocate_slugs([sample['name'] for sample in samples])
+                Product.objects.bulk_create([
+                    Product(**{**sample, 'slug': slug, 'stock': random.randint(0, 100)}, primary_image_src=PLACEHOLDER_IMAGE)
+                    for sample, slug in zip(samples, slugs)
+                ])
+            retry_on_conflict(write)
+
+        # Bulk writes send no signals
+        invalidate_page_tags('catalogue', *{f'category:{sample["category"].pk}' for sample in products_data})
+        autocomplete.rebuild()
+        product_sampler.invalidate()
@@ -0,0 +1,65 @@
+import multiprocessing
+import os
+
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.models import Q
+
+from store.images import IMAGE_MODELS, record_derivatives, write_derivatives
+
+
+def resize(job):
+    """Runs in a pool process, which only reads and writes files: the parent records the results"""
+    model_label, pk, name = job
+    storage = apps.get_model(model_label)._meta.get_field('image').storage
+    try:
+        return model_label, pk, name, write_derivatives(storage, name), None
+    except (OSError, ValueError) as e:
+        return model_label, pk, name, None, str(e)
+
+
+class Command(BaseCommand):
+    help = 'Write the resized and WebP derivatives of uploaded images that have none yet, in a pool of processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=os.cpu_count() or 1, help='Pool processes resizing images')
+        parser.add_argument('--force', action='store_true', help='Rewrite the derivatives of every image')
+
+    def handle(self, *args, **options):
+        jobs = []
+        for model in IMAGE_MODELS:
+            # Rows with an image_url show that image, mirror_remote_images handles them
+            rows = model.objects.exclude(image='').exclude(image__isnull=True).filter(
+                Q(image_url='') | Q(image_url__isnull=True)
+            ).values_list('pk', 'image', 'image_variants')
+            jobs += [
+                (model._meta.label, pk, name) for pk, name, variants in rows
+                if options['force'] or variants.get('name') != name
+            ]
+        if not jobs:
+            self.stdout.write(self.style.SUCCESS('Every image already has its derivatives'))
+            return
+
+        resized = failed = 0
+        if options['processes'] > 1:
+            connections.close_all()
+            pool = multiprocessing.get_context('fork').Pool(options['processes'])
+            results = pool.imap_unordered(resize, jobs)
+        else:
+            pool = None
+            results = map(resize, jobs)
+        try:
+            for model_label, pk, name, variants, error in results:
+                if error:
+                    failed += 1
+                    self.stderr.write(f'{model_label} {pk}: could not resize {name}: {error}')
+                    continue
+                record_derivatives(apps.get_model(model_label), pk, variants)
+                resized += 1
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        self.stdout.write(self.style.SUCCESS(f'Resized {resized} images, {failed} failed'))
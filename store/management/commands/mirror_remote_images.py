@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from store.mirror import MIRROR_CONCURRENCY, MIRROR_RETRIES, mirror_rows, unmirrored_rows
+
+
+class Command(BaseCommand):
+    help = 'Download the remote image_url images of the catalogue and store local copies with their derivatives'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=MIRROR_CONCURRENCY, help='Downloads running at once')
+        parser.add_argument('--retries', type=int, default=MIRROR_RETRIES, help='Retries of a failed download')
+        parser.add_argument('--batch-size', type=int, default=200, help='Rows mirrored and saved at a time')
+        parser.add_argument('--retry-failed', action='store_true', help='Download again the URLs that failed before')
+
+    def handle(self, *args, **options):
+        # Listed up front: mirroring a batch updates the rows being read
+        rows = list(unmirrored_rows())
+        if not rows:
+            self.stdout.write(self.style.SUCCESS('Every remote image is already mirrored'))
+            return
+
+        mirrored = failed = 0
+        batch_size = options['batch_size']
+        for start in range(0, len(rows), batch_size):
+            batch_mirrored, batch_failed = mirror_rows(
+                rows[start:start + batch_size], options['concurrency'], options['retries'], options['retry_failed']
+            )
+            mirrored += batch_mirrored
+            failed += batch_failed
+            self.stdout.write(f'{min(start + batch_size, len(rows))}/{len(rows)} rows')
+
+        self.stdout.write(self.style.SUCCESS(f'Mirrored {mirrored} remote images, {failed} failed'))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from store.autocomplete import autocomplete
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the product autocomplete index and publish it to Redis when configured'
+
+    def handle(self, *args, **options):
+        count = autocomplete.rebuild()
+        target = 'Redis and this process' if autocomplete.redis is not None else 'this process'
+        self.stdout.write(
+            self.style.SUCCESS(f'Indexed {count} products in {target}')
+        )
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from store.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Recompute the stored primary image of every product from its images'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Products loaded and updated at a time')
+
+    def handle(self, *args, **options):
+        updated = Product.objects.refresh_primary_images(batch_size=options['batch_size'])
+        self.stdout.write(
+            self.style.SUCCESS(f'Rebuilt primary images for {updated} products')
+        )
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from store.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Recompute the stored rating aggregates of every product from its reviews'
+
+    def handle(self, *args, **options):
+        updated = Product.objects.rebuild_rating_aggregates()
+        self.stdout.write(
+            self.style.SUCCESS(f'Rebuilt rating aggregates for {updated} products')
+        )
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from store.flash_inventory import get_flash_inventory
+
+
+class Command(BaseCommand):
+    help = 'Write flash-sale claims counted outside the database back to quantity_available (run periodically, e.g. from cron)'
+
+    def handle(self, *args, **options):
+        updated = get_flash_inventory().reconcile()
+        self.stdout.write(
+            self.style.SUCCESS(f'Reconciled {updated} flash sale items')
+        )
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from store.trending import refresh_snapshot
+
+
+class Command(BaseCommand):
+    help = 'Recompute the trending categories and products snapshot (run periodically, e.g. from cron)'
+
+    def handle(self, *args, **options):
+        snapshot = refresh_snapshot()
+        self.stdout.write(
+            self.style.SUCCESS(f"Trending categories: {snapshot['category_ids']}")
+        )
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from store.tasks import sync_due_flash_sale_campaigns
+
+
+class Command(BaseCommand):
+    help = 'Apply sale prices of flash sale campaigns that have started and revert those that have ended (what celery beat runs every minute)'
+
+    def handle(self, *args, **options):
+        synced = sync_due_flash_sale_campaigns()
+        self.stdout.write(
+            self.style.SUCCESS(f'Synced prices of {synced} flash sale campaigns')
+        )
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.30 on 2026-10-16 22:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0009_product_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='flashsalecampaign',
+            name='prices_applied_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='flashsalecampaign',
+            name='prices_reverted_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.CreateModel(
+            name='FlashSalePriceAudit',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('previous_sale_price', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('applied_sale_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('applied_at', models.DateTimeField(auto_now_add=True)),
+                ('reverted_at', models.DateTimeField(blank=True, null=True)),
+                ('campaign', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='price_audits', to='store.flashsalecampaign')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='flash_sale_price_audits', to='store.product')),
+            ],
+            options={
+                'ordering': ['-applied_at'],
+            },
+        ),
+    ]
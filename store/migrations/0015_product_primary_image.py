@@ -0,0 +1,74 @@
+# Generated by Django 4.2.30 on 2026-10-16 23:03
+
+from django.db import migrations, models
+from django.db.models import Prefetch
+
+PLACEHOLDER_IMAGE = "/static/images/placeholder.html"
+
+
+def get_variants(obj):
+    # As DerivedImageModel.get_variants()
+    if obj.image_url:
+        matches = obj.image_variants.get('url') == obj.image_url
+    else:
+        matches = bool(obj.image) and obj.image_variants.get('name') == obj.image.name
+    return obj.image_variants['sizes'] if matches else None
+
+
+def get_primary_image(product):
+    # As Product.image_owner and resolve_primary_image()
+    images = list(product.images.all())
+    if product.image_url:
+        owner = product
+    else:
+        owner = next((image for image in images if image.is_primary), None)
+        if owner is None:
+            owner = product if product.image else (images[0] if images else None)
+    if owner is None:
+        return PLACEHOLDER_IMAGE, {}
+    variants = get_variants(owner)
+    if variants:
+        url = owner.image.storage.url
+        sources = {
+            size: {'width': variant['width'], 'src': url(variant['src']), 'webp': url(variant['webp'])}
+            for size, variant in variants.items()
+        }
+        return sources['card']['src'], sources
+    if owner.image_url:
+        return owner.image_url, {}
+    return owner.image.url if owner.image else PLACEHOLDER_IMAGE, {}
+
+
+def populate_primary_images(apps, schema_editor):
+    Product = apps.get_model('store', 'Product')
+    ProductImage = apps.get_model('store', 'ProductImage')
+    products = Product.objects.prefetch_related(Prefetch('images', queryset=ProductImage.objects.order_by('pk')))
+    changed = []
+    for product in products.iterator(chunk_size=500):
+        product.primary_image_src, product.primary_image_sources = get_primary_image(product)
+        changed.append(product)
+        if len(changed) >= 500:
+            Product.objects.bulk_update(changed, ['primary_image_src', 'primary_image_sources'])
+            changed = []
+    Product.objects.bulk_update(changed, ['primary_image_src', 'primary_image_sources'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0014_mirrored_image'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='primary_image_sources',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='primary_image_src',
+            field=models.CharField(blank=True, editable=False, max_length=2000),
+        ),
+        migrations.RunPython(populate_primary_images, migrations.RunPython.noop),
+    ]
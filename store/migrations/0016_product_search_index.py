@@ -0,0 +1,26 @@
+# Generated by Django 4.2.30 on 2026-10-16 23:42
+
+import django.contrib.postgres.search
+from django.db import migrations
+import store.search
+
+
+def drop_legacy_search_index(apps, schema_editor):
+    # 0009 used to create this index with raw SQL on PostgreSQL
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS store_product_search_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0015_product_primary_image'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_legacy_search_index, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='product',
+            index=store.search.ProductSearchIndex(django.contrib.postgres.search.SearchVector('name', 'description', config='english'), name='product_search_idx'),
+        ),
+    ]
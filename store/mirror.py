@@ -0,0 +1,176 @@
+"""
+Local copies of remote images.
+
+image_url fields hot-link images on other hosts, so pages waited on those
+hosts. Each remote URL is now downloaded once, concurrently by an asyncio
+downloader (at most MIRROR_CONCURRENCY at a time, retrying failures with
+backoff), stored under a name derived from its content so identical images
+are stored once, and resized like uploads (see store.images). Rows showing
+the URL get its image_variants record, and get_image_source() serves the
+local copies from then on. Until a URL is mirrored, or if it can't be, the
+remote URL is used as before.
+
+Downloads are blocking urllib requests run in threads: there is no async
+HTTP client among the requirements, and the event loop only schedules them.
+MirroredImage keeps one row per URL with the outcome, so the
+mirror_remote_images command and the mirror_image_url task never fetch a
+URL twice.
+"""
+import asyncio
+import hashlib
+import mimetypes
+import urllib.error
+import urllib.request
+from collections import defaultdict
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db.models import F
+from django.utils import timezone
+
+from .images import IMAGE_MODELS, write_derivatives
+from .models import MirroredImage, Product, ProductImage
+
+MIRROR_CONCURRENCY = 8
+MIRROR_RETRIES = 3
+MIRROR_TIMEOUT = 10              # seconds per attempt
+RETRY_DELAY = 1                  # seconds before the first retry, doubled after each
+MAX_IMAGE_BYTES = 10 * 1024 * 1024
+USER_AGENT = 'Omniferous-ImageMirror/1.0'
+
+
+class DownloadError(Exception):
+    def __init__(self, message, retry=True):
+        super().__init__(message)
+        self.retry = retry
+
+
+def get_url_hash(url):
+    return hashlib.sha256(url.encode()).hexdigest()
+
+
+def download(url, timeout=MIRROR_TIMEOUT):
+    """Fetch an image, returning (content, content type)"""
+    request = urllib.request.Request(url, headers={'User-Agent': USER_AGENT})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            content_type = response.headers.get_content_type()
+            if not content_type.startswith('image/'):
+                raise DownloadError(f'Not an image: {content_type}', retry=False)
+            content = response.read(MAX_IMAGE_BYTES + 1)
+    except urllib.error.HTTPError as e:
+        # Only server errors and rate limiting may go away on their own
+        raise DownloadError(f'HTTP {e.code}', retry=e.code >= 500 or e.code == 429)
+    except ValueError as e:
+        raise DownloadError(str(e), retry=False)
+    except OSError as e:
+        raise DownloadError(str(e))
+    if len(content) > MAX_IMAGE_BYTES:
+        raise DownloadError(f'Larger than {MAX_IMAGE_BYTES} bytes', retry=False)
+    return content, content_type
+
+
+def store_copy(content, content_type, storage=default_storage):
+    """Store downloaded content under its hash and resize it, returning (content hash, variants)"""
+    content_hash = hashlib.sha256(content).hexdigest()
+    extension = mimetypes.guess_extension(content_type) or '.img'
+    name = f'mirror/{content_hash[:2]}/{content_hash}{extension}'
+    if not storage.exists(name):
+        name = storage.save(name, ContentFile(content))
+    return content_hash, write_derivatives(storage, name)
+
+
+async def mirror_one(url, semaphore, retries, storage):
+    """Returns (url, content hash, variants, error, attempts)"""
+    async with semaphore:
+        attempts = 0
+        while True:
+            attempts += 1
+            try:
+                content, content_type = await asyncio.to_thread(download, url)
+                break
+            except DownloadError as e:
+                if not e.retry or attempts > retries:
+                    return url, '', None, str(e), attempts
+            await asyncio.sleep(RETRY_DELAY * 2 ** (attempts - 1))
+        try:
+            content_hash, variants = await asyncio.to_thread(store_copy, content, content_type, storage)
+        except (OSError, ValueError) as e:
+            # Not an image Pillow can read, retrying won't help
+            return url, '', None, f'Could not resize: {e}', attempts
+        return url, content_hash, variants, '', attempts
+
+
+async def mirror_all(urls, concurrency, retries, storage):
+    semaphore = asyncio.Semaphore(concurrency)
+    return await asyncio.gather(*[mirror_one(url, semaphore, retries, storage) for url in urls])
+
+
+def fetch_urls(urls, concurrency=MIRROR_CONCURRENCY, retries=MIRROR_RETRIES, storage=default_storage):
+    """Download and store `urls` concurrently, see mirror_one()"""
+    return asyncio.run(mirror_all(urls, concurrency, retries, storage))
+
+
+def apply_variants(rows, variants):
+    """Point (model, pk) rows showing variants['url'] at its local copies"""
+    now = timezone.now()
+    for model, pks in rows.items():
+        updates = {'image_variants': variants}
+        if any(field.name == 'updated_at' for field in model._meta.fields):
+            updates['updated_at'] = now
+        model.objects.filter(pk__in=pks, image_url=variants['url']).update(**updates)
+        if model is Product:
+            Product.objects.filter(pk__in=pks).refresh_primary_images()
+        elif model is ProductImage:
+            # Cached product cards are keyed on the product's updated_at
+            products = Product.objects.filter(pk__in=ProductImage.objects.filter(pk__in=pks).values('product_id'))
+            products.update(updated_at=now)
+            products.refresh_primary_images()
+
+
+def mirror_rows(rows, concurrency=MIRROR_CONCURRENCY, retries=MIRROR_RETRIES, retry_failed=False):
+    """
+    Mirror the remote images of (model, pk, url) rows. URLs mirrored before
+    are not fetched again, nor are those that failed unless `retry_failed`.
+    Returns the number of URLs mirrored and failed.
+    """
+    by_url = defaultdict(lambda: defaultdict(list))
+    for model, pk, url in rows:
+        by_url[url][model].append(pk)
+    hashes = {get_url_hash(url): url for url in by_url}
+    known = {mirrored.url_hash: mirrored for mirrored in MirroredImage.objects.filter(url_hash__in=hashes)}
+
+    to_fetch = []
+    for url_hash, url in hashes.items():
+        mirrored = known.get(url_hash)
+        if mirrored is not None and mirrored.is_mirrored():
+            apply_variants(by_url[url], mirrored.variants)
+        elif mirrored is None or retry_failed:
+            to_fetch.append(url)
+
+    mirrored_count = failed = 0
+    now = timezone.now()
+    for url, content_hash, variants, error, attempts in fetch_urls(to_fetch, concurrency, retries):
+        if variants is not None:
+            variants = {'url': url, **variants}
+            apply_variants(by_url[url], variants)
+            mirrored_count += 1
+        else:
+            failed += 1
+        defaults = {
+            'url': url, 'content_hash': content_hash, 'variants': variants or {}, 'error': error,
+            'mirrored_at': now if variants is not None else None,
+        }
+        mirrored, created = MirroredImage.objects.get_or_create(url_hash=get_url_hash(url), defaults={**defaults, 'attempts': attempts})
+        if not created:
+            MirroredImage.objects.filter(pk=mirrored.pk).update(attempts=F('attempts') + attempts, updated_at=now, **defaults)
+    return mirrored_count, failed
+
+
+def unmirrored_rows():
+    """(model, pk, url) for every row showing a remote image without local copies"""
+    for model in IMAGE_MODELS:
+        queryset = model.objects.exclude(image_url='').exclude(image_url__isnull=True)
+        for pk, url, variants in queryset.values_list('pk', 'image_url', 'image_variants').iterator():
+            if variants.get('url') != url:
+                yield model, pk, url
@@ -1,11 +1,76 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator, MaxValueValidator
 from decimal import Decimal
-from django.db.models import Avg # Import Avg
+from django.db.models import Case, Count, ExpressionWrapper, F, OuterRef, Prefetch, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, NullIf
+from functools import cached_property
 
+from .search import PostgresSearchBackend, ProductSearchIndex
 
-class Category(models.Model):
+PLACEHOLDER_IMAGE = "/static/images/placeholder.html"
+
+
+class DerivedImageModel(models.Model):
+    """
+    A model with an uploaded `image` or a remote `image_url` whose resized
+    derivatives are recorded in image_variants, see store.images (uploads)
+    and store.mirror (local copies of remote images).
+    """
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
+
+    default_image_size = 'card'
+
+    class Meta:
+        abstract = True
+
+    def get_variants(self):
+        """The derivatives of the current image by size, or None if it has none yet"""
+        if self.image_url:
+            # A mirrored remote image
+            matches = self.image_variants.get('url') == self.image_url
+        else:
+            matches = bool(self.image) and self.image_variants.get('name') == self.image.name
+        return self.image_variants['sizes'] if matches else None
+
+    def get_image_source(self, size=None):
+        variants = self.get_variants()
+        if variants:
+            return self.image.storage.url(variants[size or self.default_image_size]['src'])
+        # Remote images not mirrored (yet) are hot-linked
+        if self.image_url:
+            return self.image_url
+        if self.image:
+            return self.image.url
+        return PLACEHOLDER_IMAGE # Default placeholder
+
+    def get_image_sources(self):
+        """URLs of the image's derivatives by size, or None if it has none yet"""
+        variants = self.get_variants()
+        if not variants:
+            return None
+        url = self.image.storage.url
+        return {
+            size: {'width': variant['width'], 'src': url(variant['src']), 'webp': url(variant['webp'])}
+            for size, variant in variants.items()
+        }
+
+    def get_image_srcset(self, webp=False):
+        """srcset of the image's derivatives, empty when there are none"""
+        return format_srcset(self.get_image_sources(), webp)
+
+
+def format_srcset(sources, webp=False):
+    if not sources:
+        return ''
+    widths = {}
+    for source in sources.values():
+        # Images smaller than a size are not enlarged, leaving sizes of the same width
+        widths.setdefault(source['width'], source['webp' if webp else 'src'])
+    return ', '.join(f'{url} {width}w' for width, url in sorted(widths.items()))
+
+
+class Category(DerivedImageModel):
     name = models.CharField(max_length=100)
     slug = models.SlugField(unique=True)
     description = models.TextField(blank=True)
@@ -24,15 +89,83 @@ class Category(models.Model):
     def get_absolute_url(self):
         return f'/category/{self.slug}/'
 
-    def get_image_source(self):
-        if self.image_url:
-            return self.image_url
-        if self.image:
-            return self.image.url
-        return "/static/images/placeholder.html" # Default placeholder
-
 
-class Product(models.Model):
+class OutOfStock(Exception):
+    message = 'Not enough stock available for'
+
+    def __init__(self, products):
+        self.products = products
+        names = ', '.join(product.name for product in products)
+        super().__init__(f'{self.message}: {names}')
+
+
+class ProductQuerySet(models.QuerySet):
+    def with_images(self):
+        """Prefetch the product images, for pages showing all of them and refresh_primary_images()"""
+        return self.prefetch_related(
+            Prefetch('images', queryset=ProductImage.objects.order_by('pk'))
+        )
+
+    def with_effective_price(self):
+        """Annotate the price customers pay: the sale price if set, otherwise the regular price"""
+        # Wrapped so that on SQLite the expression compiles exactly like product_effective_price_idx
+        return self.annotate(effective_price=ExpressionWrapper(
+            Coalesce('sale_price', 'price'), output_field=models.DecimalField(max_digits=10, decimal_places=2)
+        ))
+
+    def reserve_stock(self, quantities):
+        """
+        Take {product_id: quantity} out of stock in a single conditional UPDATE.
+        Either every product has enough stock and all are decremented, or
+        nothing changes and OutOfStock lists the products that fell short.
+        """
+        quantities = {product_id: quantity for product_id, quantity in quantities.items() if quantity > 0}
+        if not quantities:
+            return
+        needed = Case(
+            *[When(pk=product_id, then=Value(quantity)) for product_id, quantity in quantities.items()],
+            output_field=models.PositiveIntegerField(),
+        )
+        try:
+            with transaction.atomic():
+                updated = self.filter(pk__in=quantities, stock__gte=needed).update(stock=F('stock') - needed)
+                if updated != len(quantities):
+                    raise OutOfStock([])
+        except OutOfStock:
+            short = [
+                product for product in self.filter(pk__in=quantities).only('name', 'stock')
+                if product.stock < quantities[product.pk]
+            ]
+            raise OutOfStock(short)
+        from .page_cache import invalidate_page_tags, product_tags
+        transaction.on_commit(lambda: invalidate_page_tags(*product_tags(quantities)))
+
+    def refresh_primary_images(self, batch_size=500):
+        """Recompute the stored primary image of each product, returning how many changed"""
+        changed = []
+        updated = 0
+        for product in self.with_images().iterator(chunk_size=batch_size):
+            src, sources = product.resolve_primary_image()
+            if (src, sources) != (product.primary_image_src, product.primary_image_sources):
+                product.primary_image_src, product.primary_image_sources = src, sources
+                changed.append(product)
+            if len(changed) >= batch_size:
+                updated += Product.objects.bulk_update(changed, ['primary_image_src', 'primary_image_sources'])
+                changed = []
+        if changed:
+            updated += Product.objects.bulk_update(changed, ['primary_image_src', 'primary_image_sources'])
+        return updated
+
+    def rebuild_rating_aggregates(self):
+        """Recompute rating_sum/rating_count from the Review table in a single UPDATE"""
+        product_reviews = Review.objects.filter(product=OuterRef('pk')).order_by().values('product')
+        return self.update(
+            rating_sum=Coalesce(Subquery(product_reviews.annotate(total=Sum('rating')).values('total')), 0),
+            rating_count=Coalesce(Subquery(product_reviews.annotate(count=Count('pk')).values('count')), 0),
+        )
+
+
+class Product(DerivedImageModel):
     category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='products')
     name = models.CharField(max_length=200)
     slug = models.SlugField(unique=True)
@@ -44,11 +177,30 @@ class Product(models.Model):
     featured = models.BooleanField(default=False)
     image = models.ImageField(upload_to='products/', blank=True, null=True)
     image_url = models.URLField(max_length=2000, blank=True, null=True) # New field for Product primary image URL
+    # Review aggregates, kept up to date by the Review signals in store.signals
+    rating_sum = models.PositiveIntegerField(default=0)
+    rating_count = models.PositiveIntegerField(default=0)
+    # The image shown for the product (see image_owner) and its derivatives' URLs by size,
+    # kept up to date by the signals in store.signals. Empty until first computed
+    primary_image_src = models.CharField(max_length=2000, blank=True, editable=False)
+    primary_image_sources = models.JSONField(default=dict, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = ProductQuerySet.as_manager()
+
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Keyset pagination of the catalogue in each sort order (see store.pagination)
+            models.Index(fields=['created_at', 'id'], name='product_created_idx'),
+            models.Index(fields=['name', 'id'], name='product_name_idx'),
+            models.Index(Coalesce('sale_price', 'price'), 'id', name='product_effective_price_idx'),
+            # Latest change to the catalogue, part of the listing ETags
+            models.Index(fields=['updated_at'], name='product_updated_idx'),
+            # Full-text search on PostgreSQL (see store.search)
+            ProductSearchIndex(PostgresSearchBackend.get_document(), name='product_search_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -56,19 +208,59 @@ class Product(models.Model):
     def get_absolute_url(self):
         return f'/product/{self.slug}/'
 
-    def get_image_source(self):
+    @cached_property
+    def image_owner(self):
+        """The object whose image the product shows: the product itself, one of its ProductImages or None"""
         # Prioritize direct image_url, then primary ProductImage, then direct image, then any other ProductImage
         if self.image_url:
-            return self.image_url
-        primary_product_image = self.images.filter(is_primary=True).first()
+            return self
+        if self.pk is None:
+            return self if self.image else None
+        if 'images' in getattr(self, '_prefetched_objects_cache', {}):
+            # Images were prefetched by with_images(), resolve them without further queries
+            product_images = list(self.images.all())
+            primary_product_image = next((image for image in product_images if image.is_primary), None)
+            first_product_image = lambda: product_images[0] if product_images else None
+        else:
+            primary_product_image = self.images.filter(is_primary=True).first()
+            first_product_image = self.images.first
         if primary_product_image:
-            return primary_product_image.get_image_source()
+            return primary_product_image
         if self.image:
-            return self.image.url
-        first_product_image = self.images.first()
-        if first_product_image:
-            return first_product_image.get_image_source()
-        return "/static/images/placeholder.html" # Default placeholder
+            return self
+        return first_product_image()
+
+    def resolve_primary_image(self):
+        """The primary_image_src and primary_image_sources of the product's current images"""
+        owner = self.image_owner
+        if owner is None:
+            return PLACEHOLDER_IMAGE, {}
+        if owner is self:
+            return super().get_image_source(), super().get_image_sources() or {}
+        return owner.get_image_source(), owner.get_image_sources() or {}
+
+    def refresh_primary_image(self):
+        """Store the product's current primary image, see ProductQuerySet.refresh_primary_images()"""
+        self.__dict__.pop('image_owner', None)
+        src, sources = self.resolve_primary_image()
+        if (src, sources) != (self.primary_image_src, self.primary_image_sources):
+            self.primary_image_src, self.primary_image_sources = src, sources
+            Product.objects.filter(pk=self.pk).update(primary_image_src=src, primary_image_sources=sources)
+
+    def get_image_source(self, size=None):
+        src, sources = self.primary_image_src, self.primary_image_sources
+        if not src:
+            # Not stored yet, see refresh_primary_images()
+            src, sources = self.resolve_primary_image()
+        if size and sources:
+            return sources[size]['src']
+        return src
+
+    def get_image_srcset(self, webp=False):
+        sources = self.primary_image_sources
+        if not self.primary_image_src:
+            sources = self.resolve_primary_image()[1]
+        return format_srcset(sources, webp)
 
     def get_price(self):
         if self.sale_price:
@@ -85,21 +277,20 @@ class Product(models.Model):
         return self.sale_price is not None and self.sale_price < self.price
 
     def get_average_rating(self):
-        # Use aggregate to calculate the average rating, returns None if no reviews
-        return self.reviews.aggregate(Avg('rating'))['rating__avg']
+        # Returns None if no reviews
+        if not self.rating_count:
+            return None
+        return self.rating_sum / self.rating_count
+
+    def get_review_count(self):
+        return self.rating_count
 
     def is_in_flash_sale(self):
-        from django.utils import timezone
-        now = timezone.now()
-        return self.flashsaleitem_set.filter(
-            campaign__is_active=True,
-            campaign__start_date__lte=now,
-            campaign__end_date__gte=now,
-            quantity_available__gt=0
-        ).exists()
+        from .flash_sales import get_active_flash_sale
+        return self.pk in get_active_flash_sale().product_ids
 
 
-class ProductImage(models.Model):
+class ProductImage(DerivedImageModel):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='images')
     image = models.ImageField(upload_to='products/', blank=True, null=True)
     image_url = models.URLField(max_length=2000, blank=True, null=True) # New field for image URL
@@ -110,13 +301,6 @@ class ProductImage(models.Model):
     def __str__(self):
         return f"{self.product.name} - {self.alt_text}"
 
-    def get_image_source(self):
-        if self.image_url:
-            return self.image_url
-        if self.image:
-            return self.image.url
-        return "/static/images/placeholder.html" # Or a default placeholder image path
-
 
 class Review(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reviews')
@@ -129,6 +313,7 @@ class Review(models.Model):
     class Meta:
         unique_together = ['product', 'user']
         ordering = ['-created_at']
+        indexes = [models.Index(fields=['created_at', 'id'], name='review_created_idx')]
 
     def __str__(self):
         return f"{self.user.username} - {self.product.name}"
@@ -145,11 +330,36 @@ class Cart(models.Model):
             return f"Cart for {self.user.username}"
         return f"Cart {self.id}"
 
+    def get_summary(self):
+        """Item count and price total from one aggregate query, computed once per instance"""
+        if not hasattr(self, '_summary'):
+            self._summary = self.items.totals()
+        return self._summary
+
     def get_total_price(self):
-        return sum(item.get_total_price() for item in self.items.all())
+        return self.get_summary()['total_price']
 
     def get_total_items(self):
-        return sum(item.quantity for item in self.items.all())
+        return self.get_summary()['total_items']
+
+
+class CartItemQuerySet(models.QuerySet):
+    def with_products(self):
+        """Load each item's product and category along with the items"""
+        return self.select_related('product__category')
+
+    def totals(self):
+        """Item count and price total of these cart items in a single aggregate query"""
+        # Same rule as Product.get_price(): a zero or missing sale price means the regular price
+        unit_price = Coalesce(NullIf(F('product__sale_price'), 0), F('product__price'))
+        totals = self.aggregate(
+            total_items=Sum('quantity'),
+            total_price=Sum(unit_price * F('quantity'), output_field=models.DecimalField(max_digits=12, decimal_places=2)),
+        )
+        return {
+            'total_items': totals['total_items'] or 0,
+            'total_price': (totals['total_price'] or Decimal('0')).quantize(Decimal('0.01')),
+        }
 
 
 class CartItem(models.Model):
@@ -159,6 +369,8 @@ class CartItem(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = CartItemQuerySet.as_manager()
+
     def __str__(self):
         return f"{self.quantity}x {self.product.name}"
 
@@ -271,7 +483,7 @@ class Wishlist(models.Model):
         return f"{self.user.username} - {self.product.name}"
 
 
-class Ad(models.Model):
+class Ad(DerivedImageModel):
     name = models.CharField(max_length=200)
     image = models.ImageField(upload_to='ads/', blank=True, null=True)
     image_url = models.URLField(max_length=2000, blank=True, null=True)
@@ -284,22 +496,20 @@ class Ad(models.Model):
         verbose_name_plural = 'Ads'
         ordering = ['-created_at']
 
+    # Shown as a full-width banner
+    default_image_size = 'detail'
+
     def __str__(self):
         return self.name
 
-    def get_image_source(self):
-        if self.image_url:
-            return self.image_url
-        if self.image:
-            return self.image.url
-        return "/static/images/placeholder.html"
-
 
 class FlashSaleCampaign(models.Model):
     name = models.CharField(max_length=200)
     start_date = models.DateTimeField()
     end_date = models.DateTimeField()
     is_active = models.BooleanField(default=True)
+    prices_applied_at = models.DateTimeField(null=True, blank=True, editable=False)
+    prices_reverted_at = models.DateTimeField(null=True, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -310,6 +520,16 @@ class FlashSaleCampaign(models.Model):
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        # The prices_* timestamps are written by store.campaigns with update(), keep
+        # saves of an instance loaded before from putting back their old values
+        if not self._state.adding and not args and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in ('prices_applied_at', 'prices_reverted_at')
+            ]
+        super().save(*args, **kwargs)
+
     def is_currently_active(self):
         from django.utils import timezone
         now = timezone.now()
@@ -333,11 +553,37 @@ class FlashSaleItem(models.Model):
     def is_available(self):
         return self.campaign.is_currently_active() and self.quantity_available > 0
 
-    def save(self, *args, **kwargs):
-        super().save(*args, **kwargs) # Call the original save method first
-        # Update the associated product's sale_price
-        if self.product:
-            # Fetch a fresh instance of the product to ensure we're not working with a stale object
-            product_instance = self.product.__class__.objects.get(pk=self.product.pk)
-            product_instance.sale_price = self.sale_price
-            product_instance.save()
\ No newline at end of file
+
+class FlashSalePriceAudit(models.Model):
+    """A product sale price replaced while a campaign ran, restored when it ends"""
+    campaign = models.ForeignKey(FlashSaleCampaign, on_delete=models.CASCADE, related_name='price_audits')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='flash_sale_price_audits')
+    previous_sale_price = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
+    applied_sale_price = models.DecimalField(max_digits=10, decimal_places=2)
+    applied_at = models.DateTimeField(auto_now_add=True)
+    reverted_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-applied_at']
+
+    def __str__(self):
+        return f"{self.product} ({self.campaign}): {self.previous_sale_price} -> {self.applied_sale_price}"
+
+
+class MirroredImage(models.Model):
+    """A remote image_url downloaded and stored locally, see store.mirror"""
+    url = models.URLField(max_length=2000)
+    url_hash = models.CharField(max_length=64, unique=True)  # sha256 of the URL, which is too long to index
+    content_hash = models.CharField(max_length=64, blank=True)
+    variants = models.JSONField(default=dict, blank=True)  # image_variants record of the local copy
+    attempts = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    mirrored_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.url
+
+    def is_mirrored(self):
+        return bool(self.variants)
@@ -0,0 +1,197 @@
+"""
+Full-page cache for anonymous visitors.
+
+Logged-out visitors all see the same home, category and product pages, so
+those are cached whole, keyed by path and query string. Each cached page
+records the versions of the tags it was built from (product:<id>,
+category:<id>, flash-sales, ...), and a lookup only serves it while all of
+those versions are unchanged: serving a page costs two cache reads and no
+queries. Model changes bump the tags (see store.signals and the bulk updates
+that bypass signals).
+
+The two per-visitor parts of a page, the CSRF token and the cart badge, are
+stored as placeholders and filled in for each request. The same tag versions
+make the page's ETag (see page_etag()), so repeat visitors are answered with
+304 Not Modified.
+
+Flash sales also start and end by time alone, without bumping their tag, so
+pages tagged flash-sales depend on the running campaign and its next
+boundary too (see flash_sale_state()).
+"""
+import hashlib
+import re
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+
+from .caching import HitCounter, bump_version, get_version, version_key
+from .cart import CartSummary
+
+PAGE_TIMEOUT = 10 * 60
+CSRF_PLACEHOLDER = 'PAGE-CSRF-TOKEN'
+CART_COUNT_PLACEHOLDER = 'PAGE-CART-COUNT'
+# Every page shows the category navbar, and flash sale prices or badges
+BASE_TAGS = ('categories', 'flash-sales')
+
+CSRF_INPUT = re.compile(r'(name="csrfmiddlewaretoken" value=")[^"]*(")')
+
+page_stats = HitCounter('pages')
+
+
+def tag_namespace(tag):
+    return f'page-tag:{tag}'
+
+
+def invalidate_page_tags(*tags):
+    for tag in set(tags):
+        bump_version(tag_namespace(tag))
+
+
+def product_tags(product_ids):
+    return [f'product:{product_id}' for product_id in product_ids]
+
+
+def get_tag_versions(tags):
+    keys = {version_key(tag_namespace(tag)): tag for tag in tags}
+    found = cache.get_many(list(keys))
+    return {tag: found[key] if key in found else get_version(tag_namespace(tag)) for key, tag in keys.items()}
+
+
+def visitor_tags(request):
+    """Tags for what a page shows of the visitor's own data"""
+    if request.user.is_authenticated:
+        return [f'wishlist:{request.user.pk}']
+    return []
+
+
+def flash_sale_state(tags):
+    """The running campaign and its next boundary, for pages with `tags` showing flash sales"""
+    from .flash_sales import get_active_flash_sale
+
+    if 'flash-sales' not in tags:
+        return ''
+    active = get_active_flash_sale()
+    return f'{active.campaign.pk if active.campaign else ""}@{active.valid_until}'
+
+
+def page_etag(request, tag_versions, *values):
+    """
+    ETag of a page built from tags at `tag_versions` and any other `values`,
+    as shown to this visitor: their login, CSRF cookie and cart badge are
+    part of the page too.
+    """
+    parts = [f'{tag}={version}' for tag, version in sorted(tag_versions.items())]
+    parts.append(flash_sale_state(tag_versions))
+    parts += [str(value) for value in values]
+    parts += [
+        str(request.user.pk),
+        request.COOKIES.get(settings.CSRF_COOKIE_NAME, ''),
+        str(CartSummary(request).get_total_items()),
+    ]
+    return '"%s"' % hashlib.md5('|'.join(parts).encode()).hexdigest()
+
+
+def tag_page(request, *tags):
+    """Record what the page being rendered for `request` depends on"""
+    if hasattr(request, 'page_tags'):
+        request.page_tags.update(tags)
+
+
+class PlaceholderCart:
+    """Stands in for the cart summary while a page is rendered for the cache"""
+
+    def get_total_items(self):
+        return CART_COUNT_PLACEHOLDER
+
+
+def get_page_key(request):
+    digest = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    return f'page:{digest}'
+
+
+def is_cacheable(request):
+    return (
+        request.method in ('GET', 'HEAD')
+        and not request.user.is_authenticated
+        and request.headers.get('x-requested-with') != 'XMLHttpRequest'
+        # Flash messages are shown once, to one visitor
+        and 'messages' not in request.COOKIES
+    )
+
+
+def get_page(key):
+    entry = cache.get(key)
+    if entry is None:
+        return None
+    current = cache.get_many([version_key(tag_namespace(tag)) for tag in entry['tags']])
+    for tag, version in entry['tags'].items():
+        if current.get(version_key(tag_namespace(tag))) != version:
+            return None
+    # Cache expiry is only accurate to the second, the page may outlive a boundary by a little
+    if entry.get('flash_sale') != flash_sale_state(entry['tags']):
+        return None
+    return entry
+
+
+def store_page(key, response, tags):
+    from .flash_sales import get_active_flash_sale
+
+    content = CSRF_INPUT.sub(rf'\g<1>{CSRF_PLACEHOLDER}\g<2>', response.content.decode(response.charset))
+    timeout = PAGE_TIMEOUT
+    valid_until = get_active_flash_sale().valid_until
+    if valid_until is not None:
+        # A campaign starting or ending changes the page without any save
+        timeout = min(timeout, max(int((valid_until - timezone.now()) / timedelta(seconds=1)), 1))
+    entry = {
+        'content': content,
+        'content_type': response['Content-Type'],
+        'tags': {tag: get_version(tag_namespace(tag)) for tag in tags},
+        'flash_sale': flash_sale_state(tags),
+    }
+    cache.set(key, entry, timeout)
+    return entry
+
+
+def render_page(request, entry):
+    etag = page_etag(request, entry['tags'])
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        content = entry['content'].replace(CSRF_PLACEHOLDER, get_token(request))
+        content = content.replace(CART_COUNT_PLACEHOLDER, str(CartSummary(request).get_total_items()))
+        response = HttpResponse(content, content_type=entry['content_type'])
+    response['ETag'] = etag
+    return response
+
+
+def cache_anonymous_page(view):
+    """Serve `view` from the page cache to anonymous visitors, see tag_page()"""
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not is_cacheable(request):
+            return view(request, *args, **kwargs)
+        key = get_page_key(request)
+        entry = get_page(key)
+        if entry is not None:
+            page_stats.hit()
+            return render_page(request, entry)
+
+        page_stats.miss()
+        request.page_tags = set(BASE_TAGS)
+        try:
+            response = view(request, *args, **kwargs)
+        finally:
+            # Error pages rendered after an exception show the real cart
+            tags = request.__dict__.pop('page_tags')
+        if response.status_code != 200 or response.streaming or response.cookies:
+            return response
+        # The view rendered the cart badge as a placeholder, fill it in like for a cached page
+        return render_page(request, store_page(key, response, tags))
+
+    return wrapper
@@ -0,0 +1,171 @@
+"""
+Keyset (cursor) pagination.
+
+Pages are fetched with a WHERE on the sort key of the last row shown instead
+of an OFFSET, so any page costs the same as the first, and no COUNT(*) is
+needed to know whether there is a next page. The position travels in the
+?page parameter as an opaque cursor. CursorPage mimics Django's Page closely
+enough for the existing pagination templates: previous_page_number() and
+next_page_number() return cursors, and there are no numbered pages.
+"""
+import base64
+import binascii
+import json
+from functools import cached_property
+
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db.models import BigIntegerField, Q
+
+
+def encode_cursor(values, reverse=False):
+    payload = json.dumps([values, reverse], default=str, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return (values, reverse) from a cursor, or None if it is not a valid one"""
+    try:
+        payload = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values, reverse = json.loads(payload)
+    except (ValueError, TypeError, binascii.Error):
+        return None
+    if not isinstance(values, list) or not isinstance(reverse, bool):
+        return None
+    return values, reverse
+
+
+class CursorPage:
+    def __init__(self, object_list, paginator, previous_cursor, next_cursor):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.previous_cursor = previous_cursor
+        self.next_cursor = next_cursor
+        self.number = None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    def next_page_number(self):
+        return self.next_cursor
+
+    def previous_page_number(self):
+        return self.previous_cursor
+
+
+class CursorPaginator:
+    """
+    Paginate `queryset` in the order of `ordering`, a list of field or
+    annotation names (prefixed with '-' for descending) ending in a unique
+    field such as 'id' so that every row has a distinct position.
+    """
+    page_range = range(0)
+
+    def __init__(self, queryset, per_page, ordering):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.ordering = ordering
+        self.fields = [name.lstrip('-') for name in ordering]
+
+    @cached_property
+    def count(self):
+        return self.queryset.order_by().count()
+
+    def get_position(self, obj):
+        return [getattr(obj, field) for field in self.fields]
+
+    def get_field(self, name):
+        annotation = self.queryset.query.annotations.get(name)
+        return annotation.output_field if annotation is not None else self.queryset.model._meta.get_field(name)
+
+    def clean_position(self, values):
+        """Cursor `values` as the types of the ordering fields, raising ValidationError if one is not valid for its field"""
+        position = []
+        for name, value in zip(self.fields, values):
+            if value is None:
+                # Keyset lookups can't compare with NULL
+                raise ValidationError(f'Missing value for {name}.')
+            value = self.get_field(name).clean(value, None)
+            # SQLite has no range validators, and overflows on integers beyond 64 bits
+            if isinstance(value, int) and abs(value) > BigIntegerField.MAX_BIGINT:
+                raise ValidationError(f'Invalid value for {name}.')
+            position.append(value)
+        return position
+
+    def after(self, values, reverse):
+        """Filter for the rows that come after `values`, or before them when reversing"""
+        condition = Q()
+        for i in reversed(range(len(self.ordering))):
+            descending = self.ordering[i].startswith('-') != reverse
+            lookup = f"{self.fields[i]}__{'lt' if descending else 'gt'}"
+            equal = Q(**{field: value for field, value in zip(self.fields[:i], values[:i])})
+            condition |= equal & Q(**{lookup: values[i]})
+        return condition
+
+    def get_page(self, cursor):
+        position = decode_cursor(cursor) if cursor else None
+        if position is not None and len(position[0]) != len(self.ordering):
+            position = None
+        if position is not None:
+            # A tampered cursor, or one from another sort order, gets the first page like an invalid page number
+            try:
+                position = self.clean_position(position[0]), position[1]
+            except (ValidationError, ValueError, TypeError):
+                position = None
+        reverse = position is not None and position[1]
+        ordering = self.ordering
+        if reverse:
+            ordering = [name[1:] if name.startswith('-') else f'-{name}' for name in ordering]
+
+        queryset = self.queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self.after(*position))
+        rows = list(queryset[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if reverse:
+            rows.reverse()
+
+        previous_cursor = next_cursor = None
+        if rows:
+            has_previous = has_more if reverse else position is not None
+            has_next = position is not None if reverse else has_more
+            if has_previous:
+                previous_cursor = encode_cursor(self.get_position(rows[0]), reverse=True)
+            if has_next:
+                next_cursor = encode_cursor(self.get_position(rows[-1]))
+        return CursorPage(rows, self, previous_cursor, next_cursor)
+
+
+def paginate(request, queryset, per_page, ordering=None, count=None):
+    """
+    Page through `queryset` with cursors when an `ordering` is given. Numbered
+    ?page links from before cursors, and orderings keyset pagination can't
+    follow (such as search relevance), still get an OFFSET page. An exact
+    `count` already known saves the paginator counting again.
+    """
+    page = request.GET.get('page')
+    if ordering is None:
+        paginator = Paginator(queryset, per_page)
+    elif page and page.isdigit():
+        paginator = Paginator(queryset.order_by(*ordering), per_page)
+    else:
+        paginator = CursorPaginator(queryset, per_page, ordering)
+    if count is not None:
+        paginator.count = count
+    return paginator.get_page(page)
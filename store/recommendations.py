@@ -0,0 +1,57 @@
+"""
+Random product recommendations without ORDER BY RANDOM().
+
+Each worker keeps the ids of available products, overall and per category,
+samples ids from them in Python and then loads only the chosen rows.
+"""
+import random
+
+from .caching import ProcessMemo
+from .models import Product
+
+
+class ProductSampler:
+    def __init__(self, timeout=600):
+        self.pools = ProcessMemo('product-pool', timeout=timeout)
+
+    def get_pool(self, category_id=None):
+        """Ids of available products, optionally limited to one category"""
+        def load_pool():
+            products = Product.objects.filter(available=True)
+            if category_id is not None:
+                products = products.filter(category_id=category_id)
+            return tuple(products.order_by().values_list('id', flat=True))
+        return self.pools.get(category_id, load_pool)
+
+    def sample_ids(self, count, category_id=None, exclude=()):
+        """Pick up to `count` distinct random product ids that are not in `exclude`"""
+        pool = self.get_pool(category_id)
+        exclude = set(exclude)
+        if len(pool) <= 2 * (count + len(exclude)):
+            candidates = [product_id for product_id in pool if product_id not in exclude]
+            return random.sample(candidates, min(count, len(candidates)))
+        # The pool is much larger than what we skip, so redrawing the odd collision is cheapest
+        chosen = []
+        while len(chosen) < count:
+            product_id = random.choice(pool)
+            if product_id not in exclude:
+                chosen.append(product_id)
+                exclude.add(product_id)
+        return chosen
+
+    def sample(self, count, category_id=None, exclude=(), queryset=None):
+        """Return up to `count` random available products in random order"""
+        product_ids = self.sample_ids(count, category_id, exclude)
+        return fetch_in_order(queryset if queryset is not None else Product.objects.all(), product_ids)
+
+    def invalidate(self):
+        self.pools.invalidate()
+
+
+def fetch_in_order(queryset, product_ids):
+    """Load products by id, keeping the order of `product_ids`"""
+    products = queryset.filter(available=True).in_bulk(product_ids)
+    return [products[product_id] for product_id in product_ids if product_id in products]
+
+
+product_sampler = ProductSampler()
@@ -0,0 +1,176 @@
+"""
+Product search backends.
+
+PostgreSQL searches the GIN expression index Product declares over its name
+and description, SQLite an FTS5 table that triggers keep in sync with
+store_product. Both match every search term as a prefix and order results
+by relevance. Any other database falls back to icontains filtering.
+"""
+import re
+from functools import lru_cache
+
+from django.conf import settings
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import OperationalError, connection
+from django.db.models import Q
+from django.utils.module_loading import import_string
+
+SEARCH_TERM_RE = re.compile(r'\w+')
+MAX_SEARCH_TERMS = 10
+
+
+def get_search_terms(query):
+    """Split a free text query into lowercase word terms"""
+    return SEARCH_TERM_RE.findall(query.lower())[:MAX_SEARCH_TERMS]
+
+
+class IcontainsSearchBackend:
+    """Unindexed LIKE '%query%' search, used when no full-text index is available"""
+
+    def search(self, queryset, query):
+        return queryset.filter(Q(name__icontains=query) | Q(description__icontains=query))
+
+
+class ProductSearchIndex(GinIndex):
+    """
+    GIN index over the product search document, only created on PostgreSQL.
+    Other databases get an empty statement, as schema editors execute
+    whatever create_sql() and remove_sql() return.
+    """
+
+    def create_sql(self, model, schema_editor, using='', **kwargs):
+        if schema_editor.connection.vendor != 'postgresql':
+            return ''
+        return super().create_sql(model, schema_editor, using=using, **kwargs)
+
+    def remove_sql(self, model, schema_editor, **kwargs):
+        if schema_editor.connection.vendor != 'postgresql':
+            return ''
+        return super().remove_sql(model, schema_editor, **kwargs)
+
+
+class PostgresSearchBackend:
+    config = 'english'
+
+    @classmethod
+    def get_document(cls):
+        # Must match the expression of Product's search index for the planner to use it
+        return SearchVector('name', 'description', config=cls.config)
+
+    def search(self, queryset, query):
+        terms = get_search_terms(query)
+        if not terms:
+            return queryset.none()
+        search_query = SearchQuery(
+            ' & '.join(f'{term}:*' for term in terms), search_type='raw', config=self.config,
+        )
+        document = self.get_document()
+        return queryset.alias(search_document=document).filter(search_document=search_query).annotate(
+            search_rank=SearchRank(document, search_query),
+        ).order_by('-search_rank')
+
+
+class SqliteSearchBackend:
+    table = 'store_product_fts'
+
+    def install(self, connection):
+        """Create the FTS5 table and its sync triggers if missing, rebuilding the index when needed"""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT count(*) FROM sqlite_master WHERE type = 'trigger' AND name LIKE %s",
+                [f'{self.table}_%'],
+            )
+            if cursor.fetchone()[0] == 3:
+                return
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} USING fts5("
+                "name, description, content='store_product', content_rowid='id', "
+                "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+            )
+            cursor.execute(
+                f'CREATE TRIGGER IF NOT EXISTS {self.table}_insert AFTER INSERT ON store_product BEGIN '
+                f'INSERT INTO {self.table}(rowid, name, description) VALUES (new.id, new.name, new.description); '
+                'END'
+            )
+            cursor.execute(
+                f'CREATE TRIGGER IF NOT EXISTS {self.table}_delete AFTER DELETE ON store_product BEGIN '
+                f"INSERT INTO {self.table}({self.table}, rowid, name, description) "
+                "VALUES ('delete', old.id, old.name, old.description); "
+                'END'
+            )
+            cursor.execute(
+                f'CREATE TRIGGER IF NOT EXISTS {self.table}_update AFTER UPDATE OF name, description ON store_product BEGIN '
+                f"INSERT INTO {self.table}({self.table}, rowid, name, description) "
+                "VALUES ('delete', old.id, old.name, old.description); "
+                f'INSERT INTO {self.table}(rowid, name, description) VALUES (new.id, new.name, new.description); '
+                'END'
+            )
+            # Triggers are dropped whenever a migration rebuilds store_product, so resync everything
+            cursor.execute(f"INSERT INTO {self.table}({self.table}) VALUES ('rebuild')")
+
+    def uninstall(self, connection):
+        with connection.cursor() as cursor:
+            for trigger in ('insert', 'delete', 'update'):
+                cursor.execute(f'DROP TRIGGER IF EXISTS {self.table}_{trigger}')
+            cursor.execute(f'DROP TABLE IF EXISTS {self.table}')
+
+    def search(self, queryset, query):
+        terms = get_search_terms(query)
+        if not terms:
+            return queryset.none()
+        match = ' '.join(f'"{term}"*' for term in terms)
+        return queryset.extra(
+            tables=[self.table],
+            select={'search_rank': f'{self.table}.rank'},
+            where=[f'{self.table}.rowid = store_product.id', f'{self.table} MATCH %s'],
+            params=[match],
+        ).order_by('search_rank')
+
+
+@lru_cache(maxsize=None)
+def sqlite_search_index_installed():
+    return SqliteSearchBackend.table in connection.introspection.table_names()
+
+
+def get_full_text_backend(vendor):
+    """Return the full-text backend for a database vendor, or None if it has none"""
+    if vendor == 'postgresql':
+        return PostgresSearchBackend()
+    if vendor == 'sqlite':
+        return SqliteSearchBackend()
+    return None
+
+
+def get_search_backend():
+    backend_path = getattr(settings, 'PRODUCT_SEARCH_BACKEND', None)
+    if backend_path:
+        return import_string(backend_path)()
+    if connection.vendor == 'sqlite' and not sqlite_search_index_installed():
+        # SQLite builds without FTS5 skip the index in install_search_index()
+        return IcontainsSearchBackend()
+    return get_full_text_backend(connection.vendor) or IcontainsSearchBackend()
+
+
+def install_search_index(connection):
+    """Create the SQLite FTS5 index, PostgreSQL's index is part of Product.Meta.indexes"""
+    if connection.vendor != 'sqlite':
+        return
+    try:
+        SqliteSearchBackend().install(connection)
+    except OperationalError:
+        # This SQLite build has no FTS5 module, searches fall back to icontains
+        pass
+    sqlite_search_index_installed.cache_clear()
+
+
+def repair_search_index(connection):
+    """Reinstall the SQLite sync triggers dropped when a migration rebuilds store_product"""
+    if connection.vendor == 'sqlite' and SqliteSearchBackend.table in connection.introspection.table_names():
+        install_search_index(connection)
+
+
+def uninstall_search_index(connection):
+    if connection.vendor == 'sqlite':
+        SqliteSearchBackend().uninstall(connection)
+    sqlite_search_index_installed.cache_clear()
@@ -0,0 +1,236 @@
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete, post_migrate
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .autocomplete import autocomplete
+from .campaigns import revert_campaign_prices
+from .cart import invalidate_cart_summary
+from .categories import invalidate_categories
+from .flash_inventory import get_flash_inventory
+from .flash_sales import invalidate_flash_sales
+from .models import (
+    Ad, Cart, CartItem, Category, FlashSaleCampaign, FlashSaleItem, Product, ProductImage, Review, Wishlist,
+)
+from .page_cache import invalidate_page_tags
+from .recommendations import product_sampler
+from .search import repair_search_index
+from .tasks import generate_image_derivatives, mirror_image_url, sync_flash_sale_campaign
+
+
+def adjust_product_rating(product_id, rating_delta, count_delta):
+    """Apply a change to a product's stored rating aggregates in a single UPDATE"""
+    Product.objects.filter(pk=product_id).update(
+        rating_sum=F('rating_sum') + rating_delta,
+        rating_count=F('rating_count') + count_delta,
+        updated_at=timezone.now(),
+    )
+
+
+@receiver(pre_save, sender=Review)
+def remember_previous_rating(sender, instance, raw=False, **kwargs):
+    """Keep the stored rating of an edited review so post_save can apply the difference"""
+    instance._previous_rating = None
+    if instance.pk and not raw:
+        instance._previous_rating = Review.objects.filter(pk=instance.pk).values('product_id', 'rating').first()
+
+
+@receiver(post_save, sender=Review)
+def update_rating_on_review_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_previous_rating', None)
+    if created or previous is None:
+        adjust_product_rating(instance.product_id, instance.rating, 1)
+    elif previous['product_id'] != instance.product_id:
+        adjust_product_rating(previous['product_id'], -previous['rating'], -1)
+        adjust_product_rating(instance.product_id, instance.rating, 1)
+    elif previous['rating'] != instance.rating:
+        adjust_product_rating(instance.product_id, instance.rating - previous['rating'], 0)
+
+
+@receiver(post_delete, sender=Review)
+def update_rating_on_review_delete(sender, instance, **kwargs):
+    adjust_product_rating(instance.product_id, -instance.rating, -1)
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def invalidate_pages_on_review_change(sender, instance, **kwargs):
+    product_id = instance.product_id
+    transaction.on_commit(lambda: invalidate_page_tags(f'product:{product_id}'))
+
+
+@receiver(post_save, sender=Product)
+def update_autocomplete_on_product_save(sender, instance, raw=False, **kwargs):
+    if not raw:
+        transaction.on_commit(lambda: autocomplete.product_saved(instance))
+    transaction.on_commit(product_sampler.invalidate)
+
+
+@receiver(post_delete, sender=Product)
+def update_autocomplete_on_product_delete(sender, instance, **kwargs):
+    product_id = instance.pk
+    transaction.on_commit(lambda: autocomplete.product_deleted(product_id))
+    transaction.on_commit(product_sampler.invalidate)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_pages_on_product_change(sender, instance, **kwargs):
+    # 'catalogue' covers the home page listings a new or edited product may enter
+    tags = ['catalogue', f'product:{instance.pk}', f'category:{instance.category_id}']
+    transaction.on_commit(lambda: invalidate_page_tags(*tags))
+
+
+@receiver(post_save, sender=Product)
+def refresh_primary_image_on_product_save(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or (update_fields is not None and not {'image', 'image_url', 'image_variants'} & set(update_fields)):
+        return
+    instance.refresh_primary_image()
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def touch_product_on_image_change(sender, instance, origin=None, raw=False, **kwargs):
+    # Cached product cards are keyed on updated_at, and show the primary image
+    if not isinstance(origin, Product) and not raw:
+        products = Product.objects.filter(pk=instance.product_id)
+        products.update(updated_at=timezone.now())
+        products.refresh_primary_images()
+        product_id = instance.product_id
+        transaction.on_commit(lambda: invalidate_page_tags(f'product:{product_id}'))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Ad)
+def derive_image_variants(sender, instance, raw=False, **kwargs):
+    if raw or instance.get_variants() is not None:
+        return
+    # Without a broker the download or resizing would run inside the request saving the row,
+    # the mirror_remote_images and generate_image_derivatives commands do it instead
+    if settings.CELERY_TASK_ALWAYS_EAGER:
+        return
+    model_label, pk = sender._meta.label, instance.pk
+    if instance.image_url:
+        transaction.on_commit(lambda: mirror_image_url.delay(model_label, pk))
+    elif instance.image:
+        transaction.on_commit(lambda: generate_image_derivatives.delay(model_label, pk))
+
+
+@receiver(post_save, sender=CartItem)
+@receiver(post_delete, sender=CartItem)
+def invalidate_cart_summary_on_item_change(sender, instance, origin=None, **kwargs):
+    if isinstance(origin, Cart):
+        # Deleting the whole cart, handled once by the Cart receiver below
+        return
+    owner = Cart.objects.filter(pk=instance.cart_id).values('user_id', 'session_key').first()
+    if owner:
+        transaction.on_commit(lambda: invalidate_cart_summary(**owner))
+
+
+@receiver(post_delete, sender=Cart)
+def invalidate_cart_summary_on_cart_delete(sender, instance, **kwargs):
+    user_id, session_key = instance.user_id, instance.session_key
+    transaction.on_commit(lambda: invalidate_cart_summary(user_id=user_id, session_key=session_key))
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_categories_on_change(sender, instance, **kwargs):
+    transaction.on_commit(invalidate_categories)
+    category_id = instance.pk
+    transaction.on_commit(lambda: invalidate_page_tags('categories', f'category:{category_id}'))
+
+
+@receiver(post_save, sender=Wishlist)
+@receiver(post_delete, sender=Wishlist)
+def invalidate_pages_on_wishlist_change(sender, instance, **kwargs):
+    # Catalogue pages show logged-in visitors which products are in their wishlist
+    user_id = instance.user_id
+    transaction.on_commit(lambda: invalidate_page_tags(f'wishlist:{user_id}'))
+
+
+@receiver(post_save, sender=Ad)
+@receiver(post_delete, sender=Ad)
+def invalidate_pages_on_ad_change(sender, **kwargs):
+    transaction.on_commit(lambda: invalidate_page_tags('ads'))
+
+
+@receiver(post_save, sender=FlashSaleCampaign)
+@receiver(post_delete, sender=FlashSaleCampaign)
+@receiver(post_save, sender=FlashSaleItem)
+@receiver(post_delete, sender=FlashSaleItem)
+def invalidate_flash_sales_on_change(sender, **kwargs):
+    transaction.on_commit(invalidate_flash_sales)
+
+
+def schedule_campaign_price_sync(campaign_id):
+    """Sync a campaign's prices once after the current transaction, however many of its items changed"""
+    connection = transaction.get_connection()
+    pending = connection.__dict__.setdefault('campaign_price_syncs', {})
+    callback = pending.get(campaign_id)
+    if callback is not None and any(entry[1] is callback for entry in connection.run_on_commit):
+        return
+
+    def callback():
+        pending.pop(campaign_id, None)
+        sync_flash_sale_campaign.delay(campaign_id)
+
+    pending[campaign_id] = callback
+    transaction.on_commit(callback)
+
+
+@receiver(post_save, sender=FlashSaleCampaign)
+def sync_prices_on_campaign_save(sender, instance, raw=False, **kwargs):
+    if not raw:
+        schedule_campaign_price_sync(instance.pk)
+
+
+@receiver(post_save, sender=FlashSaleItem)
+@receiver(post_delete, sender=FlashSaleItem)
+def sync_prices_on_item_change(sender, instance, raw=False, origin=None, **kwargs):
+    if not raw and not isinstance(origin, FlashSaleCampaign):
+        schedule_campaign_price_sync(instance.campaign_id)
+
+
+@receiver(pre_delete, sender=FlashSaleCampaign)
+def revert_prices_on_campaign_delete(sender, instance, **kwargs):
+    # Its price audits are deleted along with it
+    revert_campaign_prices(instance)
+
+
+@receiver(pre_save, sender=FlashSaleItem)
+def remember_previous_allocation(sender, instance, raw=False, **kwargs):
+    """Keep the stored allocation of an edited item so post_save can tell whether it changed"""
+    instance._previous_quantity = None
+    if instance.pk and not raw:
+        instance._previous_quantity = FlashSaleItem.objects.filter(pk=instance.pk).values_list(
+            'quantity_available', flat=True
+        ).first()
+
+
+@receiver(post_save, sender=FlashSaleItem)
+def reset_flash_sale_counter(sender, instance, created, raw=False, **kwargs):
+    # A changed allocation is authoritative, restart the counter from it. Other edits
+    # leave it alone: claims not reconciled yet are only in the counter
+    if raw or (not created and instance.quantity_available == instance._previous_quantity):
+        return
+    item_id, quantity = instance.pk, instance.quantity_available
+    transaction.on_commit(lambda: get_flash_inventory().reset(item_id, quantity))
+
+
+@receiver(post_delete, sender=FlashSaleItem)
+def remove_flash_sale_counter(sender, instance, **kwargs):
+    item_id = instance.pk
+    transaction.on_commit(lambda: get_flash_inventory().remove(item_id))
+
+
+@receiver(post_migrate)
+def reinstall_search_triggers(sender, using='default', **kwargs):
+    if sender.name == 'store':
+        repair_search_index(connections[using])
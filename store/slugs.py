@@ -0,0 +1,101 @@
+"""
+Unique slugs for products and imported products.
+
+An imported product's store product takes its slug, so slugs are allocated
+free in every model of SLUG_MODELS at once. Taken slugs are numbered like
+ImportedProduct.save() used to, "t-shirt", "t-shirt-1", "t-shirt-2"...,
+but rather than probing each candidate with an exists() query,
+allocate_slugs() loads the slugs already taken for a whole batch of names:
+one query per model for the plain slugs, then one per model for the
+numbered ones of up to PREFIXES_PER_QUERY slugs that are taken or
+repeated.
+
+Two transactions can still allocate the same slug. Writes go through
+retry_on_conflict(), which runs them again, allocating afresh, when the
+unique constraint rejects them.
+"""
+from collections import Counter
+
+from django.apps import apps
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils.text import slugify
+
+SLUG_MODELS = ('store.Product', 'imported_products.ImportedProduct')
+SLUG_LENGTH = 40                 # leaves room for a -N suffix within Product.slug's 50 characters
+PREFIXES_PER_QUERY = 100
+SLUG_ATTEMPTS = 3
+
+
+def get_slug_models():
+    models = []
+    for label in SLUG_MODELS:
+        try:
+            models.append(apps.get_model(label))
+        except LookupError:
+            # imported_products is not installed
+            pass
+    return models
+
+
+def get_slug_base(name):
+    return slugify(name)[:SLUG_LENGTH].strip('-') or 'product'
+
+
+def allocate_slugs(names):
+    """A slug for each of `names`, free in every slug model and distinct from one another"""
+    models = get_slug_models()
+    bases = [get_slug_base(name) for name in names]
+    counts = Counter(bases)
+    taken = set()
+    for model in models:
+        taken.update(model.objects.filter(slug__in=counts).values_list('slug', flat=True))
+    # Bases taken or repeated in the batch are numbered, load the numbers already used
+    numbered = [base for base, count in counts.items() if count > 1 or base in taken]
+    for start in range(0, len(numbered), PREFIXES_PER_QUERY):
+        prefixes = Q()
+        for base in numbered[start:start + PREFIXES_PER_QUERY]:
+            prefixes |= Q(slug__startswith=f'{base}-')
+        for model in models:
+            taken.update(model.objects.filter(prefixes).values_list('slug', flat=True))
+
+    next_number = {}
+    slugs = []
+    for base in bases:
+        slug = base
+        if slug in taken:
+            number = next_number.get(base, 1)
+            while f'{base}-{number}' in taken:
+                number += 1
+            slug = f'{base}-{number}'
+            next_number[base] = number + 1
+        taken.add(slug)
+        slugs.append(slug)
+    return slugs
+
+
+def allocate_slug(name):
+    return allocate_slugs([name])[0]
+
+
+def retry_on_conflict(write, attempts=SLUG_ATTEMPTS):
+    """
+    Run write() in a transaction, again when it raises IntegrityError: a
+    concurrent transaction may have taken a slug it allocated, and it
+    allocates afresh when run again.
+    """
+    for attempt in range(1, attempts + 1):
+        try:
+            with transaction.atomic():
+                return write()
+        except IntegrityError:
+            if attempt == attempts:
+                raise
+
+
+def save_with_unique_slug(obj, name, save):
+    """Give `obj` a free slug made from `name` and save it with save()"""
+    def write():
+        obj.slug = allocate_slug(name)
+        return save()
+    return retry_on_conflict(write)
@@ -0,0 +1,70 @@
+import logging
+
+from celery import shared_task
+from django.apps import apps
+
+from .campaigns import campaigns_due, sync_campaign_prices
+from .flash_inventory import get_flash_inventory
+from .images import record_derivatives, write_derivatives
+from .mirror import mirror_rows
+from .models import FlashSaleCampaign
+from .trending import refresh_snapshot
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def sync_flash_sale_campaign(campaign_id):
+    """Apply or revert one campaign's prices after it or its items changed"""
+    campaign = FlashSaleCampaign.objects.filter(pk=campaign_id).first()
+    if campaign is not None:
+        sync_campaign_prices(campaign)
+
+
+@shared_task
+def sync_due_flash_sale_campaigns():
+    """Apply prices of campaigns that have started and revert those that have ended"""
+    campaigns = list(campaigns_due())
+    for campaign in campaigns:
+        sync_campaign_prices(campaign)
+    return len(campaigns)
+
+
+@shared_task
+def reconcile_flash_sales():
+    return get_flash_inventory().reconcile()
+
+
+@shared_task
+def refresh_trending():
+    refresh_snapshot()
+
+
+@shared_task
+def generate_image_derivatives(model_label, pk):
+    """Resize a newly uploaded image, see store.images"""
+    model = apps.get_model(model_label)
+    obj = model.objects.filter(pk=pk).only('image', 'image_url', 'image_variants').first()
+    if obj is None or not obj.image or obj.image_url or obj.get_variants() is not None:
+        # Rows with an image_url show that image instead, see mirror_image_url
+        return
+    try:
+        variants = write_derivatives(obj.image.storage, obj.image.name)
+    except (OSError, ValueError):
+        # Unreadable or missing upload, keep serving the original
+        logger.exception('Could not resize %s %s image %s', model_label, pk, obj.image.name)
+        return
+    record_derivatives(model, pk, variants)
+
+
+@shared_task
+def mirror_image_url(model_label, pk):
+    """Store a local copy of a newly set remote image, see store.mirror"""
+    model = apps.get_model(model_label)
+    obj = model.objects.filter(pk=pk).only('image', 'image_url', 'image_variants').first()
+    if obj is None or not obj.image_url or obj.get_variants() is not None:
+        return
+    mirrored, failed = mirror_rows([(model, pk, obj.image_url)])
+    if failed:
+        # Recorded on its MirroredImage, the remote URL stays hot-linked
+        logger.warning('Could not mirror %s %s image %s', model_label, pk, obj.image_url)
@@ -0,0 +1,93 @@
+"""
+Fragment cache for product cards.
+
+    {% load product_cards %}
+    {% productcard 'grid' product %}
+        ... card markup ...
+        {% cardslot %}... per-user markup, e.g. the wishlist heart ...{% endcardslot %}
+    {% endproductcard %}
+
+The card is rendered once per product version, keyed on the product id, its
+updated_at, whether it is in the running flash sale and any extra values
+given after the product, and then served from the cache for everyone.
+{% csrf_token %} inside a card is cached as a placeholder and each
+{% cardslot %} as a marker, both filled in for the current request.
+"""
+from django import template
+from django.core.cache import cache
+
+from store.caching import HitCounter
+
+register = template.Library()
+
+CARD_TIMEOUT = 60 * 60
+CSRF_PLACEHOLDER = 'CARD-CSRF-TOKEN'
+
+card_stats = HitCounter('product-cards')
+
+
+def card_cache_key(name, product, extra):
+    parts = [name, product.pk, product.updated_at.timestamp(), int(product.is_in_flash_sale())]
+    parts += extra
+    return 'card:' + ':'.join(str(part) for part in parts)
+
+
+class CardSlotNode(template.Node):
+    def __init__(self, nodelist):
+        self.nodelist = nodelist
+        self.marker = ''
+
+    def render(self, context):
+        return self.marker
+
+
+class ProductCardNode(template.Node):
+    def __init__(self, nodelist, name, product, extra):
+        self.nodelist = nodelist
+        self.name = name
+        self.product = product
+        self.extra = extra
+        self.slots = nodelist.get_nodes_by_type(CardSlotNode)
+        # Markers must be the same in every process sharing the cache
+        for number, slot in enumerate(self.slots):
+            slot.marker = f'<!--card-slot-{number}-->'
+
+    def render(self, context):
+        product = self.product.resolve(context)
+        key = card_cache_key(
+            self.name.resolve(context), product, [value.resolve(context) for value in self.extra]
+        )
+        html = cache.get(key)
+        if html is None:
+            card_stats.miss()
+            with context.push(csrf_token=CSRF_PLACEHOLDER):
+                html = self.nodelist.render(context)
+            cache.set(key, html, CARD_TIMEOUT)
+        else:
+            card_stats.hit()
+        for slot in self.slots:
+            html = html.replace(slot.marker, slot.nodelist.render(context))
+        csrf_token = context.get('csrf_token')
+        if not csrf_token or csrf_token == 'NOTPROVIDED':
+            csrf_token = ''
+        return html.replace(CSRF_PLACEHOLDER, str(csrf_token))
+
+
+@register.tag
+def productcard(parser, token):
+    bits = token.split_contents()
+    if len(bits) < 3:
+        raise template.TemplateSyntaxError(f"'{bits[0]}' takes a card name and a product")
+    nodelist = parser.parse(('endproductcard',))
+    parser.delete_first_token()
+    return ProductCardNode(
+        nodelist, parser.compile_filter(bits[1]), parser.compile_filter(bits[2]),
+        [parser.compile_filter(bit) for bit in bits[3:]],
+    )
+
+
+@register.tag
+def cardslot(parser, token):
+    nodelist = parser.parse(('endcardslot',))
+    parser.delete_first_token()
+    return CardSlotNode(nodelist)
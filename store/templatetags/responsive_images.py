@@ -0,0 +1,40 @@
+"""
+srcset markup for images with resized derivatives (see store.images).
+
+    {% load responsive_images %}
+    <picture>
+        {% webp_source product 'card' %}
+        <img src="{{ product.get_image_source }}"{% srcset product 'card' %} alt="...">
+    </picture>
+
+Both tags render nothing for images without derivatives, such as remote
+image_url images, leaving the plain <img src>.
+"""
+from django import template
+from django.utils.html import format_html
+
+register = template.Library()
+
+# How wide each kind of slot is drawn, for the browser to pick a derivative
+SLOT_SIZES = {
+    'thumb': '100px',
+    'card': '(min-width: 992px) 25vw, (min-width: 768px) 33vw, 100vw',
+    'detail': '(min-width: 992px) 50vw, 100vw',
+    'banner': '100vw',
+}
+
+
+@register.simple_tag
+def srcset(obj, slot='card'):
+    value = obj.get_image_srcset()
+    if not value:
+        return ''
+    return format_html(' srcset="{}" sizes="{}"', value, SLOT_SIZES[slot])
+
+
+@register.simple_tag
+def webp_source(obj, slot='card'):
+    value = obj.get_image_srcset(webp=True)
+    if not value:
+        return ''
+    return format_html('<source type="image/webp" srcset="{}" sizes="{}">', value, SLOT_SIZES[slot])
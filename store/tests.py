@@ -0,0 +1,423 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock, skipUnless
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import OperationalError, connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from .autocomplete import Autocomplete
+from .campaigns import campaigns_due
+from .flash_inventory import DatabaseInventory, FlashSaleSoldOut, MemoryInventory, flash_sale_claims
+from .models import Category, FlashSaleCampaign, FlashSaleItem, Product
+from .pagination import CursorPaginator, encode_cursor
+from .search import IcontainsSearchBackend, get_search_backend
+from .trending import LOCK_KEY, SNAPSHOT_KEY, get_snapshot, pick_trending_product_ids
+
+
+class CursorPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Shirts', slug='shirts')
+        for i in range(15):
+            Product.objects.create(
+                category=cls.category, name=f'Shirt {i:02}', slug=f'shirt-{i}', description='', price=Decimal(10 + i)
+            )
+
+    def setUp(self):
+        cache.clear()
+
+    def get_page(self, cursor, ordering=('name', 'id')):
+        paginator = CursorPaginator(Product.objects.with_effective_price(), 12, list(ordering))
+        return paginator.get_page(cursor)
+
+    def test_next_page(self):
+        first = self.get_page(None)
+        second = self.get_page(first.next_page_number())
+        self.assertEqual([product.name for product in second], ['Shirt 12', 'Shirt 13', 'Shirt 14'])
+
+    def test_malformed_cursor_gets_first_page(self):
+        for cursor in ['not-a-cursor', encode_cursor(['x', 'y']), encode_cursor([None, None]), encode_cursor([{}, []])]:
+            with self.subTest(cursor=cursor):
+                page = self.get_page(cursor, ('effective_price', 'id'))
+                self.assertEqual(page[0].name, 'Shirt 00')
+                self.assertFalse(page.has_previous())
+
+    def test_out_of_range_cursor_gets_first_page(self):
+        page = self.get_page(encode_cursor(['Shirt 05', 10 ** 30]))
+        self.assertEqual(page[0].name, 'Shirt 00')
+
+    def test_cursor_from_another_sort_gets_first_page(self):
+        name_cursor = self.get_page(None).next_page_number()
+        page = self.get_page(name_cursor, ('effective_price', 'id'))
+        self.assertEqual(page[0].name, 'Shirt 00')
+
+    def test_product_list_with_invalid_cursors(self):
+        name_cursor = self.get_page(None).next_page_number()
+        for sort in ['', 'name', 'price', '-created_at']:
+            for cursor in [encode_cursor(['x', 'y']), encode_cursor([None, None]), name_cursor]:
+                with self.subTest(sort=sort, cursor=cursor):
+                    response = self.client.get(
+                        reverse('store:product_list'), {'sort_by': sort, 'page': cursor}, secure=True
+                    )
+                    self.assertEqual(response.status_code, 200)
+
+
+class CampaignPriceTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name='Shirts', slug='shirts')
+        self.product = Product.objects.create(
+            category=category, name='Shirt', slug='shirt', description='', price=Decimal('500.00')
+        )
+        now = timezone.now()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.campaign = FlashSaleCampaign.objects.create(
+                name='Sale', start_date=now - timedelta(hours=1), end_date=now + timedelta(hours=1)
+            )
+            FlashSaleItem.objects.create(
+                campaign=self.campaign, product=self.product, sale_price=Decimal('300.00'), quantity_available=5
+            )
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.sale_price, Decimal('300.00'))
+
+    def end_stale_campaign(self):
+        # Loaded before its prices were applied
+        self.assertIsNone(self.campaign.prices_applied_at)
+        self.campaign.end_date = timezone.now() - timedelta(minutes=1)
+        self.campaign.save()
+
+    def test_stale_instance_save_reverts_prices(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.end_stale_campaign()
+        self.product.refresh_from_db()
+        self.assertIsNone(self.product.sale_price)
+        self.assertFalse(campaigns_due().exists())
+
+    def test_stale_instance_save_keeps_campaign_due(self):
+        self.end_stale_campaign()
+        self.assertEqual(list(campaigns_due()), [self.campaign])
+        self.campaign.refresh_from_db()
+        self.assertIsNotNone(self.campaign.prices_applied_at)
+
+
+class ImageTaskTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name='Shirts', slug='shirts')
+
+    def save_product(self, **fields):
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(
+                category=self.category, name='Shirt', slug='shirt', description='', price=Decimal('10.00'), **fields
+            )
+
+    @override_settings(CELERY_TASK_ALWAYS_EAGER=True)
+    def test_remote_image_not_mirrored_inline(self):
+        with mock.patch('store.signals.mirror_image_url') as task:
+            self.save_product(image_url='https://images.example.com/shirt.jpg')
+        task.delay.assert_not_called()
+
+    @override_settings(CELERY_TASK_ALWAYS_EAGER=False)
+    def test_remote_image_mirrored_by_worker(self):
+        with mock.patch('store.signals.mirror_image_url') as task:
+            self.save_product(image_url='https://images.example.com/shirt.jpg')
+        task.delay.assert_called_once()
+
+    @override_settings(CELERY_TASK_ALWAYS_EAGER=True)
+    def test_upload_not_resized_inline(self):
+        with mock.patch('store.signals.generate_image_derivatives') as task:
+            self.save_product(image='products/shirt.jpg')
+        task.delay.assert_not_called()
+
+    @override_settings(CELERY_TASK_ALWAYS_EAGER=False)
+    def test_upload_resized_by_worker(self):
+        with mock.patch('store.signals.generate_image_derivatives') as task:
+            self.save_product(image='products/shirt.jpg')
+        task.delay.assert_called_once()
+
+
+class FlashSaleBoundaryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.now = timezone.now()
+        category = Category.objects.create(name='Shirts', slug='shirts')
+        product = Product.objects.create(
+            category=category, name='Shirt', slug='shirt', description='', price=Decimal('500.00')
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            campaign = FlashSaleCampaign.objects.create(
+                name='Sale', start_date=self.now + timedelta(hours=1), end_date=self.now + timedelta(hours=2)
+            )
+            FlashSaleItem.objects.create(
+                campaign=campaign, product=product, sale_price=Decimal('300.00'), quantity_available=5
+            )
+
+    def assert_etag_changes_when_campaign_starts(self, url):
+        # The first response sets the CSRF cookie, part of the ETag
+        self.client.get(url, secure=True)
+        etag = self.client.get(url, secure=True)['ETag']
+        self.assertEqual(self.client.get(url, secure=True, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        with mock.patch('django.utils.timezone.now', return_value=self.now + timedelta(minutes=90)):
+            response = self.client.get(url, secure=True, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_home_etag_changes_when_campaign_starts(self):
+        self.assert_etag_changes_when_campaign_starts(reverse('store:home'))
+
+    def test_product_etag_changes_when_campaign_starts(self):
+        self.assert_etag_changes_when_campaign_starts(reverse('store:product_detail', args=['shirt']))
+
+
+class FlashSaleCounterTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Shirts', slug='shirts')
+        product = Product.objects.create(
+            category=category, name='Shirt', slug='shirt', description='', price=Decimal('500.00')
+        )
+        now = timezone.now()
+        campaign = FlashSaleCampaign.objects.create(
+            name='Sale', start_date=now - timedelta(hours=1), end_date=now + timedelta(hours=1)
+        )
+        self.inventory = MemoryInventory()
+        patcher = mock.patch('store.signals.get_flash_inventory', return_value=self.inventory)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.item = FlashSaleItem.objects.create(
+                campaign=campaign, product=product, sale_price=Decimal('300.00'), quantity_available=5
+            )
+        self.assertEqual(self.inventory.claim({self.item.pk: 3}), [])
+
+    def claimable(self):
+        units = 0
+        while not self.inventory.claim({self.item.pk: 1}):
+            units += 1
+        return units
+
+    def test_other_edits_keep_claims(self):
+        self.item.sale_price = Decimal('250.00')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.item.save()
+        self.assertEqual(self.claimable(), 2)
+
+    def test_new_allocation_less_pending_claims(self):
+        self.item.quantity_available = 10
+        with self.captureOnCommitCallbacks(execute=True):
+            self.item.save()
+        self.assertEqual(self.claimable(), 7)
+        self.inventory.reconcile()
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.quantity_available, 0)
+
+
+class FlashSaleClaimTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Shirts', slug='shirts')
+        self.product = Product.objects.create(
+            category=category, name='Shirt', slug='shirt', description='', price=Decimal('500.00')
+        )
+        now = timezone.now()
+        campaign = FlashSaleCampaign.objects.create(
+            name='Sale', start_date=now - timedelta(hours=1), end_date=now + timedelta(hours=1)
+        )
+        self.item = FlashSaleItem.objects.create(
+            campaign=campaign, product=self.product, sale_price=Decimal('300.00'), quantity_available=5
+        )
+
+    def fail_order(self, inventory):
+        with mock.patch('store.flash_inventory.get_flash_inventory', return_value=inventory):
+            with self.assertRaises(ValueError):
+                with flash_sale_claims([(self.product, 3)]):
+                    Product.objects.filter(pk=self.product.pk).update(stock=1)
+                    raise ValueError
+
+    def test_failed_order_rolls_back_database_claim(self):
+        self.fail_order(DatabaseInventory())
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.quantity_available, 5)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 0)
+
+    def test_failed_order_releases_counter_claim(self):
+        inventory = MemoryInventory()
+        self.fail_order(inventory)
+        self.assertEqual(inventory.claim({self.item.pk: 5}), [])
+
+
+class FlashSaleRaceTests(TransactionTestCase):
+    """Concurrent claims never sell more than the allocation"""
+    stock = 20
+    claims = 100
+
+    def setUp(self):
+        category = Category.objects.create(name='Shirts', slug='shirts')
+        self.product = Product.objects.create(
+            category=category, name='Shirt', slug='shirt', description='', price=Decimal('500.00')
+        )
+        now = timezone.now()
+        campaign = FlashSaleCampaign.objects.create(
+            name='Sale', start_date=now - timedelta(hours=1), end_date=now + timedelta(hours=1)
+        )
+        self.item = FlashSaleItem.objects.create(
+            campaign=campaign, product=self.product, sale_price=Decimal('300.00'), quantity_available=self.stock
+        )
+
+    def claim(self, _):
+        try:
+            while True:
+                try:
+                    with flash_sale_claims([(self.product, 1)]):
+                        return True
+                except FlashSaleSoldOut:
+                    return False
+                except OperationalError:
+                    # SQLite's shared in-memory test database fails on lock contention rather than waiting
+                    if connection.vendor != 'sqlite':
+                        raise
+        finally:
+            connection.close()
+
+    def race(self, inventory):
+        with mock.patch('store.flash_inventory.get_flash_inventory', return_value=inventory):
+            with ThreadPoolExecutor(8) as executor:
+                won = sum(executor.map(self.claim, range(self.claims)))
+        inventory.reconcile()
+        self.item.refresh_from_db()
+        self.assertEqual(won, self.stock)
+        self.assertEqual(self.item.quantity_available, 0)
+
+    def test_database_inventory(self):
+        self.race(DatabaseInventory())
+
+    def test_memory_inventory(self):
+        self.race(MemoryInventory())
+
+
+class BuyNowTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Shirts', slug='shirts')
+        self.product = Product.objects.create(
+            category=category, name='Shirt', slug='shirt', description='', price=Decimal('500.00'), stock=5
+        )
+        self.client.force_login(User.objects.create_user('buyer', password='x'))
+
+    def buy_now(self, quantity):
+        return self.client.post(
+            reverse('store:buy_now_direct', args=[self.product.pk]), {'quantity': quantity}, secure=True
+        )
+
+    def test_buy_now_reserves_stock(self):
+        self.buy_now(2)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 3)
+        self.assertEqual(self.product.orderitem_set.get().quantity, 2)
+
+    def test_buy_now_beyond_stock_orders_nothing(self):
+        Product.objects.filter(pk=self.product.pk).update(stock=1)
+        # The page the buyer saw still showed 5 in stock
+        with mock.patch('store.views.get_object_or_404', return_value=self.product):
+            self.buy_now(2)
+        self.assertFalse(self.product.orderitem_set.exists())
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 1)
+
+
+class TrendingProductTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name='Shirts', slug='shirts')
+        self.shirt, self.hat = [
+            Product.objects.create(category=category, name=name, slug=name.lower(), description='', price=Decimal('10.00'))
+            for name in ['Shirt', 'Hat']
+        ]
+        self.gone = Product.objects.create(
+            category=category, name='Scarf', slug='scarf', description='', price=Decimal('10.00')
+        )
+        # Computed while the scarf was still available
+        cache.set(SNAPSHOT_KEY, {
+            'category_ids': [category.pk], 'products': {category.pk: [self.hat.pk, self.gone.pk]},
+            'computed_at': time.time(),
+        })
+        Product.objects.filter(pk=self.gone.pk).update(available=False)
+
+    def test_unavailable_trending_products_not_shown(self):
+        response = self.client.get(reverse('store:product_detail', args=['shirt']), secure=True)
+        self.assertNotIn(self.gone, response.context['trending_products'])
+
+    def test_cold_cache_computed_by_lock_holder_only(self):
+        cache.delete(SNAPSHOT_KEY)
+        # Another process is computing the first snapshot
+        cache.add(LOCK_KEY, 1)
+        with mock.patch('store.trending.compute_snapshot') as compute:
+            self.assertEqual(get_snapshot()['category_ids'], [])
+            self.assertEqual(len(pick_trending_product_ids(per_category=2, total=2)), 2)
+        compute.assert_not_called()
+
+
+class SearchTests(TestCase):
+    """The full-text backend for the test database, PostgresSearchBackend on PostgreSQL"""
+
+    def setUp(self):
+        category = Category.objects.create(name='Clothes', slug='clothes')
+        for name, description in [
+            ('Linen trousers', 'Goes with any shirt'),
+            ('Blue shirt', 'A linen shirt, the shirt for summer'),
+            ('Wool hat', 'Warm and blue'),
+        ]:
+            Product.objects.create(
+                category=category, name=name, slug=name.lower().replace(' ', '-'), description=description,
+                price=Decimal('10.00'),
+            )
+        self.backend = get_search_backend()
+        self.assertNotIsInstance(self.backend, IcontainsSearchBackend)
+
+    def search(self, query):
+        return [product.name for product in self.backend.search(Product.objects.all(), query)]
+
+    def test_terms_match_as_prefixes(self):
+        self.assertEqual(sorted(self.search('shi')), ['Blue shirt', 'Linen trousers'])
+        self.assertEqual(self.search('blu SHI'), ['Blue shirt'])
+        self.assertEqual(self.search('hirt'), [])
+        self.assertEqual(self.search('!!'), [])
+
+    def test_ranked_by_relevance(self):
+        self.assertEqual(self.search('shirt'), ['Blue shirt', 'Linen trousers'])
+
+    @skipUnless(connection.vendor == 'postgresql', 'PostgreSQL search index')
+    def test_query_uses_search_index(self):
+        with connection.cursor() as cursor:
+            # Too few rows for the planner to prefer the index otherwise
+            cursor.execute('SET LOCAL enable_seqscan = off')
+        plan = self.backend.search(Product.objects.all(), 'shirt').explain()
+        self.assertIn('product_search_idx', plan)
+
+
+class AutocompleteRefreshTests(SimpleTestCase):
+    def entry(self, product_id, name):
+        return [product_id, name, '10.00', f'/product/{product_id}/', '']
+
+    def test_stale_index_rebuilt_in_background(self):
+        autocomplete = Autocomplete(max_age=0)
+        autocomplete.load_entries = lambda product_ids=None: [self.entry(1, 'Red Shirt')]
+        self.assertEqual([entry['id'] for entry in autocomplete.suggest('shirt')], [1])
+
+        loading = threading.Event()
+        def slow_load(product_ids=None):
+            loading.wait(5)
+            return [self.entry(1, 'Red Shirt'), self.entry(2, 'Blue Shirt')]
+        autocomplete.load_entries = slow_load
+        # Answered from the current index while the rebuild waits on the database
+        self.assertEqual([entry['id'] for entry in autocomplete.suggest('shirt')], [1])
+        autocomplete.apply_change(3, self.entry(3, 'Green Shirt'))
+        refresh_thread = autocomplete.refresh_thread
+        loading.set()
+        refresh_thread.join()
+        autocomplete.max_age = 300
+        self.assertEqual(sorted(entry['id'] for entry in autocomplete.suggest('shirt')), [1, 2, 3])
@@ -0,0 +1,115 @@
+"""
+Trending categories and products.
+
+Trending is scored from recent sales (OrderItem quantities) and wishlist adds,
+computed periodically by the refresh_trending command or lazily when the
+cached snapshot gets old. Requests only read the snapshot: while one process
+recomputes a stale snapshot, everyone else keeps serving the old one, or
+random picks when there is none yet.
+"""
+import random
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db.models import Count, Sum
+from django.utils import timezone
+
+from .models import Category, OrderItem, Wishlist
+from .recommendations import product_sampler
+
+SNAPSHOT_KEY = 'trending:snapshot'
+LOCK_KEY = 'trending:lock'
+REFRESH_AFTER = 15 * 60          # seconds before a snapshot is recomputed
+STALE_GRACE = 24 * 60 * 60       # how long a stale snapshot may still be served
+SIGNAL_WINDOW = timedelta(days=7)
+ORDER_WEIGHT = 3                 # one unit sold counts as much as three wishlist adds
+TRENDING_CATEGORIES = 3
+PRODUCTS_PER_CATEGORY = 12
+# Served while the first snapshot is computed, pick_trending_product_ids() then samples at random
+EMPTY_SNAPSHOT = {'category_ids': [], 'products': {}, 'computed_at': 0}
+
+
+def compute_snapshot():
+    """Score products and categories from recent orders and wishlist adds"""
+    since = timezone.now() - SIGNAL_WINDOW
+    product_scores = defaultdict(int)
+    product_categories = {}
+
+    sales = OrderItem.objects.filter(
+        order__created_at__gte=since, product__available=True
+    ).exclude(order__status='cancelled').values('product_id', 'product__category_id').annotate(units=Sum('quantity'))
+    for row in sales:
+        product_scores[row['product_id']] += ORDER_WEIGHT * row['units']
+        product_categories[row['product_id']] = row['product__category_id']
+
+    wishlist_adds = Wishlist.objects.filter(
+        created_at__gte=since, product__available=True
+    ).values('product_id', 'product__category_id').annotate(adds=Count('id'))
+    for row in wishlist_adds:
+        product_scores[row['product_id']] += row['adds']
+        product_categories[row['product_id']] = row['product__category_id']
+
+    category_scores = defaultdict(int)
+    category_products = defaultdict(list)
+    for product_id, score in sorted(product_scores.items(), key=lambda item: -item[1]):
+        category_id = product_categories[product_id]
+        category_scores[category_id] += score
+        if len(category_products[category_id]) < PRODUCTS_PER_CATEGORY:
+            category_products[category_id].append(product_id)
+
+    category_ids = sorted(category_scores, key=lambda category_id: -category_scores[category_id])[:TRENDING_CATEGORIES]
+    if len(category_ids) < TRENDING_CATEGORIES:
+        # Not enough recent activity, fall back to the largest categories
+        largest = Category.objects.exclude(id__in=category_ids).annotate(
+            product_count=Count('products')
+        ).order_by('-product_count').values_list('id', flat=True)[:TRENDING_CATEGORIES - len(category_ids)]
+        category_ids.extend(largest)
+
+    return {
+        'category_ids': category_ids,
+        'products': {category_id: category_products.get(category_id, []) for category_id in category_ids},
+        'computed_at': time.time(),
+    }
+
+
+def refresh_snapshot():
+    snapshot = compute_snapshot()
+    cache.set(SNAPSHOT_KEY, snapshot, REFRESH_AFTER + STALE_GRACE)
+    return snapshot
+
+
+def get_snapshot():
+    snapshot = cache.get(SNAPSHOT_KEY)
+    if snapshot is not None and time.time() - snapshot['computed_at'] < REFRESH_AFTER:
+        return snapshot
+    # Only the process that takes the lock recomputes, the others keep the stale snapshot
+    if cache.add(LOCK_KEY, 1, 60):
+        try:
+            return refresh_snapshot()
+        finally:
+            cache.delete(LOCK_KEY)
+    return snapshot if snapshot is not None else EMPTY_SNAPSHOT
+
+
+def pick_trending_product_ids(per_category=2, total=4, exclude=()):
+    """
+    Pick `per_category` products from each trending category, favouring the
+    ones with the most recent activity, then fill up to `total` at random.
+    """
+    snapshot = get_snapshot()
+    excluded = set(exclude)
+    picked = []
+    for category_id in snapshot['category_ids']:
+        candidates = [product_id for product_id in snapshot['products'][category_id] if product_id not in excluded]
+        chosen = random.sample(candidates, min(per_category, len(candidates)))
+        if len(chosen) < per_category:
+            chosen += product_sampler.sample_ids(
+                per_category - len(chosen), category_id=category_id, exclude=excluded.union(chosen)
+            )
+        picked.extend(chosen)
+        excluded.update(chosen)
+    if len(picked) < total:
+        picked.extend(product_sampler.sample_ids(total - len(picked), exclude=excluded))
+    return picked
@@ -1,9 +1,9 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
-from .decorators import delivery_man_required, staff_required # Import the new decorator
+from .decorators import conditional_page, delivery_man_required, staff_required # Import the new decorator
 from django.contrib import messages
 from django.http import JsonResponse
-from django.db.models import Q, Avg, Count, Exists, OuterRef # Import Exists and OuterRef
+from django.db.models import F, Q, Exists, Max, OuterRef # Import Exists and OuterRef
 from django.core.paginator import Paginator
 from django.conf import settings
 from django.views.decorators.http import require_POST
@@ -11,13 +11,25 @@ from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth import login
 import stripe
 import json
-from django.utils import timezone # Import timezone for flash sales
+from collections import defaultdict
 from django import forms # Import forms for OrderStatusUpdateForm
 
 from .models import (
     Product, Category, Cart, CartItem, Order, OrderItem, 
-    Review, Wishlist, Ad, FlashSaleCampaign, FlashSaleItem, DeliveryMan # Add new models
+    Review, Wishlist, Ad, FlashSaleItem, DeliveryMan, # Add new models
+    OutOfStock
 )
+from .autocomplete import autocomplete
+from .cards import card_grid_response, with_card_fields
+from .categories import get_categories
+from .counts import count_results
+from .flash_inventory import flash_sale_claims
+from .flash_sales import get_active_flash_sale
+from .page_cache import BASE_TAGS, cache_anonymous_page, product_tags, tag_page
+from .pagination import paginate
+from .recommendations import fetch_in_order, product_sampler
+from .search import get_search_backend
+from .trending import pick_trending_product_ids
 from .forms import ReviewForm, CheckoutForm, ProductSearchForm, UserRegistrationForm, AssignDeliveryForm, UserProfileForm, CustomPasswordChangeForm # Add new forms
 
 # Initialize Stripe
@@ -27,10 +39,56 @@ except AttributeError:
     stripe.api_key = 'sk_test_your_stripe_secret_key'
 
 
+# Keyset orderings for the listing sort options, each ending in a unique column
+PRODUCT_ORDERINGS = {
+    'name': ['name', 'id'],
+    '-name': ['-name', '-id'],
+    'price': ['effective_price', 'id'],
+    '-price': ['-effective_price', '-id'],
+    'created_at': ['created_at', 'id'],
+    '-created_at': ['-created_at', '-id'],
+}
+DEFAULT_PRODUCT_ORDERING = PRODUCT_ORDERINGS['-created_at']
+
+
+def is_ajax(request):
+    return request.headers.get('x-requested-with') == 'XMLHttpRequest'
+
+
+def product_list_validators(request):
+    # Only the JSON grid, refetched by infinite scroll, is validated
+    if not is_ajax(request):
+        return None
+    latest = Product.objects.aggregate(latest=Max('updated_at'))['latest']
+    return ['catalogue', *BASE_TAGS], [latest, 'ajax']
+
+
+def product_detail_validators(request, slug):
+    # Related products come from the same category, so follow its latest change too
+    row = Product.objects.filter(slug=slug, available=True).annotate(
+        related_changed=Max('category__products__updated_at')
+    ).values_list('pk', 'category_id', 'related_changed').first()
+    if row is None:
+        return None
+    product_id, category_id, related_changed = row
+    return [f'product:{product_id}', f'category:{category_id}', *BASE_TAGS], [related_changed]
+
+
+def category_detail_validators(request, slug):
+    row = Category.objects.filter(slug=slug).annotate(
+        products_changed=Max('products__updated_at')
+    ).values_list('pk', 'products_changed').first()
+    if row is None:
+        return None
+    category_id, products_changed = row
+    return [f'category:{category_id}', *BASE_TAGS], [products_changed, is_ajax(request)]
+
+
+@cache_anonymous_page
 def home(request):
     """Homepage with featured products and categories"""
     featured_products = Product.objects.filter(featured=True, available=True)[:8]
-    categories = Category.objects.all()[:6]
+    categories = get_categories()[:6]
     latest_products = Product.objects.filter(available=True).order_by('-created_at')[:4]
 
     if request.user.is_authenticated:
@@ -42,11 +100,7 @@ def home(request):
     active_ads = Ad.objects.filter(is_active=True).order_by('-created_at')
 
     # Fetch active flash sale campaign and its items
-    active_flash_sale = FlashSaleCampaign.objects.filter(
-        is_active=True, 
-        start_date__lte=timezone.now(), 
-        end_date__gte=timezone.now()
-    ).first()
+    active_flash_sale = get_active_flash_sale().campaign
 
     flash_sale_items = []
     if active_flash_sale:
@@ -54,13 +108,21 @@ def home(request):
             campaign=active_flash_sale, 
             quantity_available__gt=0,
             product__available=True
-        ).order_by('product__name')[:8] # Limit to 8 items for display
+        ).select_related('product').order_by('product__name')[:8] # Limit to 8 items for display
         
         if request.user.is_authenticated:
             # Annotate flash_sale_items' products with whether they are in the current user's wishlist
             wishlist_subquery = Wishlist.objects.filter(user=request.user, product=OuterRef('product__pk'))
             flash_sale_items = flash_sale_items.annotate(product__is_in_wishlist=Exists(wishlist_subquery))
     
+    featured_products = list(featured_products)
+    latest_products = list(latest_products)
+    tag_page(
+        request, 'catalogue', 'ads',
+        *product_tags(product.pk for product in featured_products + latest_products),
+        *product_tags(item.product_id for item in flash_sale_items),
+    )
+
     context = {
         'featured_products': featured_products,
         'categories': categories,
@@ -74,11 +136,7 @@ def home(request):
 
 def flash_sale_list(request):
     """Display all active flash sale products"""
-    active_flash_sale = FlashSaleCampaign.objects.filter(
-        is_active=True,
-        start_date__lte=timezone.now(),
-        end_date__gte=timezone.now()
-    ).first()
+    active_flash_sale = get_active_flash_sale().campaign
 
     flash_sale_items = []
     if active_flash_sale:
@@ -86,16 +144,16 @@ def flash_sale_list(request):
             campaign=active_flash_sale,
             quantity_available__gt=0,
             product__available=True
-        ).order_by('product__name')
+        ).annotate(product_name=F('product__name')).select_related('product')
         
         if request.user.is_authenticated:
             # Annotate flash_sale_items' products with whether they are in the current user's wishlist
             wishlist_subquery = Wishlist.objects.filter(user=request.user, product=OuterRef('product__pk'))
             flash_sale_items = flash_sale_items.annotate(product__is_in_wishlist=Exists(wishlist_subquery))
 
-    paginator = Paginator(flash_sale_items, 12)  # 12 items per page
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+        page_obj = paginate(request, flash_sale_items, 12, ['product_name', 'id'])  # 12 items per page
+    else:
+        page_obj = Paginator(flash_sale_items, 12).get_page(None)
 
     context = {
         'active_flash_sale': active_flash_sale,
@@ -104,6 +162,7 @@ def flash_sale_list(request):
     return render(request, 'store/flash_sale_list.html', context)
 
 
+@conditional_page(product_list_validators)
 def product_list(request):
     """Product listing page with search and filtering"""
     products = Product.objects.filter(available=True)
@@ -114,17 +173,21 @@ def product_list(request):
         wishlist_subquery = Wishlist.objects.filter(user=request.user, product=OuterRef('pk'))
         products = products.annotate(is_in_wishlist=Exists(wishlist_subquery))
 
+    # Newest first unless searching, where results stay in relevance order
+    ordering = DEFAULT_PRODUCT_ORDERING
+    count_signature = {}
     if form.is_valid():
         query = form.cleaned_data.get('query')
         category = form.cleaned_data.get('category')
         min_price = form.cleaned_data.get('min_price')
         max_price = form.cleaned_data.get('max_price')
         sort_by = form.cleaned_data.get('sort_by')
+        count_signature = {'query': query, 'category': category, 'min_price': min_price, 'max_price': max_price}
         
         if query:
-            products = products.filter(
-                Q(name__icontains=query) | Q(description__icontains=query)
-            )
+            # Results come back ordered by relevance unless a sort order is picked below
+            products = get_search_backend().search(products, query)
+            ordering = None
         
         if category:
             products = products.filter(category__slug=category)
@@ -143,46 +206,42 @@ def product_list(request):
                 Q(sale_price__isnull=True, price__lte=max_price)
             )
         
-        if sort_by:
+        if sort_by in PRODUCT_ORDERINGS:
             if sort_by in ['price', '-price']:
-                # For price sorting, we need to use a custom ordering that considers sale price
-                if sort_by == 'price':
-                    # Order by sale price if available, otherwise by regular price (ascending)
-                    products = products.extra(
-                        select={'effective_price': 'COALESCE(sale_price, price)'}
-                    ).order_by('effective_price')
-                else:  # -price
-                    # Order by sale price if available, otherwise by regular price (descending)
-                    products = products.extra(
-                        select={'effective_price': 'COALESCE(sale_price, price)'}
-                    ).order_by('-effective_price')
-            else:
-                products = products.order_by(sort_by)
+                # Order by sale price if available, otherwise by regular price
+                products = products.with_effective_price()
+            ordering = PRODUCT_ORDERINGS[sort_by]
     
+    if is_ajax(request):
+        # Grid refreshes only need the card columns, rendered client-side from JSON
+        products = with_card_fields(products)
+
     # Pagination
-    paginator = Paginator(products, 12)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    products_count = count_results(products, count_signature)
+    page_obj = paginate(
+        request, products, 12, ordering, count=None if products_count.approximate else products_count.value
+    )
+
+    if is_ajax(request):
+        return card_grid_response(request, page_obj, products_count)
     
     context = {
         'products': page_obj,
+        'products_count': products_count,
         'form': form,
-        'categories': Category.objects.all(),
+        'categories': get_categories(),
     }
 
-    if request.headers.get('x-requested-with') == 'XMLHttpRequest':
-        # If it's an AJAX request, render only the product grid partial
-        rendered_html = render(request, 'store/_product_grid.html', context).content.decode('utf-8')
-        return JsonResponse({'html': rendered_html, 'count': page_obj.paginator.count})
-
     return render(request, 'store/product_list.html', context)
 
 
+@cache_anonymous_page
+@conditional_page(product_detail_validators)
 def product_detail(request, slug):
     """Product detail page with reviews"""
-    product = get_object_or_404(Product, slug=slug, available=True)
+    product = get_object_or_404(Product.objects.with_images(), slug=slug, available=True)
     reviews = product.reviews.all()
-    average_rating = reviews.aggregate(Avg('rating'))['rating__avg'] or 0
+    average_rating = product.get_average_rating() or 0
     
     # Check if user has already reviewed
     user_review = None
@@ -193,39 +252,20 @@ def product_detail(request, slug):
         is_in_wishlist = False
     
     # Related products
-    related_products = Product.objects.filter(
+    related_products = list(Product.objects.filter(
         category=product.category, available=True
-    ).exclude(id=product.id)[:4]
+    ).exclude(id=product.id)[:4])
 
     # Collect IDs of products already displayed or excluded
     excluded_product_ids = [product.id]
-    excluded_product_ids.extend(related_products.values_list('id', flat=True))
-
-    # Trending categories and products
-    trending_categories = Category.objects.annotate(product_count=Count('products'))\
-                                          .order_by('-product_count')[:3]
-    
-    trending_products_list = []
-    for category in trending_categories:
-        # Fetch 2 products from each trending category, excluding already picked ones
-        products_from_category = Product.objects.filter(
-            category=category, available=True
-        ).exclude(id__in=excluded_product_ids).order_by('?')[:2]
-        for p in products_from_category:
-            trending_products_list.append(p)
-            excluded_product_ids.append(p.id) # Add to excluded list to avoid duplicates
-    
-    # If not enough trending products, fill with other available products randomly
-    if len(trending_products_list) < 4:
-        additional_products_needed = 4 - len(trending_products_list)
-        additional_products = Product.objects.filter(available=True)\
-                                     .exclude(id__in=excluded_product_ids).order_by('?')[:additional_products_needed]
-        for p in additional_products:
-            trending_products_list.append(p)
-    
-    # Convert the list back to a queryset for template consistency
-    # This also handles the case where trending_products_list might be empty
-    trending_products = Product.objects.filter(id__in=[p.id for p in trending_products_list])
+    excluded_product_ids.extend(related_product.id for related_product in related_products)
+
+    # Trending products come from a periodically refreshed snapshot of recent orders and wishlist adds
+    trending_product_ids = pick_trending_product_ids(per_category=2, total=4, exclude=excluded_product_ids)
+    
+    # Load all picked products at once, the snapshot may list products made unavailable since
+    trending_products = fetch_in_order(Product.objects.all(), trending_product_ids)
+    tag_page(request, *product_tags(excluded_product_ids + trending_product_ids))
     
     if request.method == 'POST' and request.user.is_authenticated:
         review_form = ReviewForm(request.POST)
@@ -252,6 +292,8 @@ def product_detail(request, slug):
     return render(request, 'store/product_detail.html', context)
 
 
+@cache_anonymous_page
+@conditional_page(category_detail_validators)
 def category_detail(request, slug):
     """Category detail page"""
     category = get_object_or_404(Category, slug=slug)
@@ -261,22 +303,28 @@ def category_detail(request, slug):
         # Annotate products with whether they are in the current user's wishlist
         wishlist_subquery = Wishlist.objects.filter(user=request.user, product=OuterRef('pk'))
         products = products.annotate(is_in_wishlist=Exists(wishlist_subquery))
+
+    if is_ajax(request):
+        products = with_card_fields(products)
     
     # Pagination
-    paginator = Paginator(products, 12)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    products_count = count_results(products, {'category': category.slug})
+    page_obj = paginate(
+        request, products, 12, DEFAULT_PRODUCT_ORDERING,
+        count=None if products_count.approximate else products_count.value
+    )
+
+    if is_ajax(request):
+        return card_grid_response(request, page_obj, products_count)
     
+    tag_page(request, f'category:{category.pk}', *product_tags(product.pk for product in page_obj))
+
     context = {
         'category': category,
         'products': page_obj,
+        'products_count': products_count,
     }
 
-    if request.headers.get('x-requested-with') == 'XMLHttpRequest':
-        # If it's an AJAX request, render only the product grid partial
-        rendered_html = render(request, 'store/_product_grid.html', context).content.decode('utf-8')
-        return JsonResponse({'html': rendered_html, 'count': page_obj.paginator.count})
-
     return render(request, 'store/category_detail.html', context)
 
 
@@ -299,11 +347,13 @@ def cart_detail(request):
     """Shopping cart page"""
     try:
         cart = get_or_create_cart(request)
-        cart_items = cart.items.all()
+        cart_items = cart.items.with_products()
         
         # Get recommended products (exclude products already in cart)
         cart_product_ids = cart_items.values_list('product_id', flat=True)
-        recommended_products = Product.objects.filter(available=True).exclude(id__in=cart_product_ids).order_by('?')[:4]
+        recommended_products = product_sampler.sample(
+            4, exclude=cart_product_ids, queryset=Product.objects.all()
+        )
         
         context = {
             'cart': cart,
@@ -366,20 +416,27 @@ def buy_now_direct(request, product_id):
 
     # Create a new, temporary order for this direct purchase
     # Do NOT add to the user's main cart
-    order = Order.objects.create(
-        user=request.user,
-        total_amount=product.get_price() * quantity,
-        payment_method='stripe', # Default payment method for now
-        status='pending', # Initial status
-        # Other fields like shipping address will be filled in checkout
-    )
+    try:
+        with flash_sale_claims([(product, quantity)]):
+            # Taken out of stock with the order, like a cart checkout
+            Product.objects.reserve_stock({product.pk: quantity})
+            order = Order.objects.create(
+                user=request.user,
+                total_amount=product.get_price() * quantity,
+                payment_method='stripe', # Default payment method for now
+                status='pending', # Initial status
+                # Other fields like shipping address will be filled in checkout
+            )
 
-    OrderItem.objects.create(
-        order=order,
-        product=product,
-        quantity=quantity,
-        price=product.get_price()
-    )
+            OrderItem.objects.create(
+                order=order,
+                product=product,
+                quantity=quantity,
+                price=product.get_price()
+            )
+    except OutOfStock as e:
+        messages.error(request, str(e))
+        return redirect('store:product_detail', slug=product.slug)
 
     messages.success(request, f'Proceeding to checkout for {product.name}!')
     return redirect('store:checkout_with_order', order_id=order.id)
@@ -428,13 +485,13 @@ def checkout(request, order_id=None):
     """Checkout page"""
     if order_id:
         order = get_object_or_404(Order, id=order_id, user=request.user, status='pending')
-        order_items = order.items.all()
+        order_items = order.items.select_related('product')
         total_amount = order.total_amount
         # No cart involved in direct buy, so cart_items will be order_items
         cart_items = order_items # For template compatibility
     else:
         cart = get_or_create_cart(request)
-        cart_items = cart.items.all()
+        cart_items = cart.items.with_products()
         total_amount = cart.get_total_price()
         order = None # No existing order if coming from cart
 
@@ -459,23 +516,37 @@ def checkout(request, order_id=None):
                 order.save()
                 messages.success(request, 'Order details updated!')
             else: # Otherwise, create a new order from cart
-                order = form.save(commit=False)
-                order.user = request.user
-                order.total_amount = total_amount
-                order.payment_method = 'stripe' # Default to stripe
-                order.status = 'pending'
-                order.save()
-                
-                # Create order items from cart items
+                reserved = defaultdict(int)
                 for cart_item in cart_items:
-                    OrderItem.objects.create(
-                        order=order,
-                        product=cart_item.product,
-                        quantity=cart_item.quantity,
-                        price=cart_item.product.get_price()
-                    )
-                # Clear cart only if it was a cart checkout
-                cart.delete()
+                    reserved[cart_item.product_id] += cart_item.quantity
+                try:
+                    lines = [(cart_item.product, cart_item.quantity) for cart_item in cart_items]
+                    with flash_sale_claims(lines):
+                        order = form.save(commit=False)
+                        order.user = request.user
+                        order.total_amount = total_amount
+                        order.payment_method = 'stripe' # Default to stripe
+                        order.status = 'pending'
+                        order.save()
+
+                        # Take the whole cart out of stock at once, nothing is ordered if any line falls short
+                        Product.objects.reserve_stock(reserved)
+
+                        # Create order items from cart items
+                        OrderItem.objects.bulk_create([
+                            OrderItem(
+                                order=order,
+                                product=cart_item.product,
+                                quantity=cart_item.quantity,
+                                price=cart_item.product.get_price()
+                            )
+                            for cart_item in cart_items
+                        ])
+                        # Clear cart only if it was a cart checkout
+                        cart.delete()
+                except OutOfStock as e:
+                    messages.error(request, str(e))
+                    return redirect('store:cart_detail')
             
             # Redirect to payment with the order ID
             return redirect('store:payment', order_id=order.id)
@@ -715,7 +786,7 @@ def register(request):
 @login_required
 def wishlist(request):
     """User's wishlist"""
-    wishlist_items = Wishlist.objects.filter(user=request.user)
+    wishlist_items = Wishlist.objects.filter(user=request.user).select_related('product')
     context = {
         'wishlist_items': wishlist_items,
     }
@@ -752,29 +823,14 @@ def remove_from_wishlist(request, product_id):
 def search_products(request):
     """AJAX search for products"""
     query = request.GET.get('q', '')
-    if query:
-        products = Product.objects.filter(
-            Q(name__icontains=query) | Q(description__icontains=query),
-            available=True
-        )[:5]
-        results = [{
-            'id': product.id,
-            'name': product.name,
-            'price': str(product.get_price()),
-            'url': product.get_absolute_url(),
-            'image': product.image.url if product.image else '',
-        } for product in products]
-    else:
-        results = []
-    
+    # Suggestions come from the in-memory name index, not the database
+    results = autocomplete.suggest(query) if query else []
     return JsonResponse({'results': results})
 
 def review_list(request):
     """List all product reviews"""
-    reviews = Review.objects.all().order_by('-created_at')
-    paginator = Paginator(reviews, 10)  # Show 10 reviews per page
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    reviews = Review.objects.all()
+    page_obj = paginate(request, reviews, 10, ['-created_at', '-id'])  # Show 10 reviews per page
     
     context = {
         'reviews': page_obj